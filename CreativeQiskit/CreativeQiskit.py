@@ -5,70 +5,635 @@
 
 from qiskit import ClassicalRegister, QuantumRegister, QuantumCircuit, execute, IBMQ
 from qiskit import Aer
-from qiskit.providers.aer.noise import NoiseModel
-from qiskit.providers.aer.noise.errors import pauli_error, depolarizing_error
-from qiskit.providers.aer import noise
-    
-from qiskit.transpiler import PassManager
 
 import numpy as np
 import random
-import matplotlib.pyplot as plt
-from matplotlib.patches import Circle, Rectangle
 import copy
-import networkx as nx
 import datetime
-try:
-    from pydub import AudioSegment # pydub can be a bit dodgy and might cause some warnings
-except:
-    pass
+import importlib
+import collections
+import concurrent.futures
+import threading
+import hashlib
+import json
+import os
+import pickle
+import re
+import time
+import functools
+import contextlib
+import warnings
+import io
+import wave
 
-try:
-    IBMQ.load_account()
-except:
-    print("No IBMQ account was found, so you'll only be able to simulate locally.")
 
-def get_backend(device):
-    """Returns backend object for device specified by input string."""
+class _lazy_module():
+    """Stands in for a module that is only imported the first time one of its attributes is used. This keeps `import CreativeQiskit` fast and free of side effects, since plotting, graph and audio libraries are only needed by a few of the tools."""
+    
+    def __init__(self,name):
+        self._name = name
+        self._module = None
+        
+    def __getattr__(self,attr):
+        if attr.startswith('__') and attr.endswith('__'):
+            # probes such as `__wrapped__` (from doctest and inspect) should neither import the module nor find a submodule
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module,attr)
+        except AttributeError: # submodules are not always imported by their parent package
+            try:
+                return importlib.import_module(self._name+'.'+attr)
+            except ImportError:
+                raise AttributeError("module '"+self._name+"' has no attribute '"+attr+"'")
+
+    
+plt = _lazy_module('matplotlib.pyplot')
+patches = _lazy_module('matplotlib.patches')
+nx = _lazy_module('networkx')
+pydub = _lazy_module('pydub') # pydub can be a bit dodgy and might cause some warnings
+noise = _lazy_module('qiskit.providers.aer.noise')
+asyncio = _lazy_module('asyncio') # only needed for the awaitable variants of methods
+figure = _lazy_module('matplotlib.figure') # used with backend_agg for off-screen rendering, without pyplot
+backend_agg = _lazy_module('matplotlib.backends.backend_agg')
+mpl_image = _lazy_module('matplotlib.image')
+
+_account_loaded = False
+
+def _load_account():
+    """Loads the IBMQ account the first time a device other than an Aer simulator is requested."""
+    global _account_loaded
+    if not _account_loaded:
+        _account_loaded = True
+        try:
+            IBMQ.load_account()
+        except:
+            print("No IBMQ account was found, so you'll only be able to simulate locally.")
+
+def _make_backend(device):
+    """Builds the backend object for device specified by input string. Use `get_backend()` instead, which caches the result."""
     try:
         backend = Aer.get_backend(device)
     except:
+        _load_account()
         print("You are using an IBMQ backend. The results for this are provided in accordance with the IBM Q Experience EULA.\nhttps://quantumexperience.ng.bluemix.net/qx/terms") # Legal stuff! Yay!
         for provider in IBMQ.providers():
             for potential_backend in provider.backends():
-                if potential_backend.name()==device_name:
+                if potential_backend.name()==device:
                     backend = potential_backend 
     return backend
 
-def get_noise(noisy):
-    """Returns a noise model when input is not False or None.
-    A string will be interpreted as the name of a backend, and the noise model of this will be extracted.
-    A float will be interpreted as an error probability for a depolarizing+measurement error model.
-    Anything else (such as True) will give the depolarizing+measurement error model with default error probabilities."""
+def _noise_params(noisy):
+    """Returns the measurement and single qubit gate error probabilities of the simple depolarizing+measurement error model specified by `noisy`."""
+    if type(noisy) is float:
+        p_meas = noisy
+        p_gate1 = noisy
+    else: # default values
+        p_meas = 0.08
+        p_gate1 = 0.04
+    return p_meas, p_gate1
+
+def _make_noise(noisy):
+    """Builds the noise model described by `noisy`. Use `get_noise()` instead, which caches the result."""
     if noisy:
         
         if type(noisy) is str: # get noise information from a real device (via the IBM Q Experience)
             device = get_backend(noisy)
             noise_model = noise.device.basic_device_noise_model( device.properties() )
         else: # make a simple noise model for a given noise strength
-            if type(noisy) is float:
-                p_meas = noisy
-                p_gate1 = noisy
-            else: # default values
-                p_meas = 0.08
-                p_gate1 = 0.04
-
-            error_meas = pauli_error([('X',p_meas), ('I', 1 - p_meas)]) # bit flip error with prob p_meas
-            error_gate1 = depolarizing_error(p_gate1, 1) # replaces qubit state with nonsense with prob p_gate1
+            p_meas, p_gate1 = _noise_params(noisy)
+
+            error_meas = noise.errors.pauli_error([('X',p_meas), ('I', 1 - p_meas)]) # bit flip error with prob p_meas
+            error_gate1 = noise.errors.depolarizing_error(p_gate1, 1) # replaces qubit state with nonsense with prob p_gate1
             error_gate2 = error_gate1.tensor(error_gate1) # as above, but independently on two qubits
 
-            noise_model = NoiseModel()
+            noise_model = noise.NoiseModel()
             noise_model.add_all_qubit_quantum_error(error_meas, "measure") # add bit flip noise to measurement
             noise_model.add_all_qubit_quantum_error(error_gate1, ["u1", "u2", "u3"]) # add depolarising to single qubit gates
             noise_model.add_all_qubit_quantum_error(error_gate2, ["cx"]) # add two qubit depolarising to two qubit gates  
     else:
         noise_model = None
     return noise_model
+
+
+class backend_registry():
+    """Keeps the backend objects and noise models that have already been built, so that they are not rebuilt every time a job is run. Entries are keyed by the device string or noise parameter used to create them. Only the `maxsize` most recently used entries are kept."""
+    
+    def __init__(self,maxsize=32):
+        """maxsize = Maximum number of backends and noise models (each counted separately) that are kept."""
+        self.maxsize = maxsize
+        self.backends = collections.OrderedDict()
+        self.noise_models = collections.OrderedDict()
+        # reentrant, since making the noise model of a device gets its backend
+        self._lock = threading.RLock()
+        
+    def _lookup(self,store,key,make):
+        # return the stored entry for `key`, or make and store it if there isn't one
+        with self._lock:
+            if key in store:
+                store.move_to_end(key)
+                return store[key]
+            entry = make()
+            store[key] = entry
+            while len(store)>self.maxsize:
+                store.popitem(last=False) # forget the least recently used entry
+            return entry
+    
+    def get_backend(self,device):
+        """Returns backend object for device specified by input string."""
+        return self._lookup(self.backends,device,lambda: _make_backend(device))
+    
+    def get_noise(self,noisy):
+        """Returns a noise model when input is not False or None. See `get_noise()` for details."""
+        if not noisy:
+            return None
+        # True and 1.0 are equal as keys, but give different noise models
+        return self._lookup(self.noise_models,(type(noisy),noisy),lambda: _make_noise(noisy))
+    
+    def invalidate(self,key=None):
+        """Forgets stored entries, so that they are rebuilt next time they are needed.
+        
+        key = A device string or noise parameter, for which the corresponding entries are forgotten. For `key=None` all entries are forgotten. This is needed when the properties of a real device have changed, for example."""
+        with self._lock:
+            if key is None:
+                self.backends.clear()
+                self.noise_models.clear()
+            else:
+                self.backends.pop(key,None)
+                self.noise_models.pop((type(key),key),None)
+
+
+registry = backend_registry()
+
+def get_backend(device):
+    """Returns backend object for device specified by input string. Backends are built only once, and then reused via `registry`."""
+    return registry.get_backend(device)
+
+def get_noise(noisy):
+    """Returns a noise model when input is not False or None.
+    A string will be interpreted as the name of a backend, and the noise model of this will be extracted.
+    A float will be interpreted as an error probability for a depolarizing+measurement error model.
+    Anything else (such as True) will give the depolarizing+measurement error model with default error probabilities.
+    Noise models are built only once for each value of `noisy`, and then reused via `registry`. They should therefore not be modified."""
+    return registry.get_noise(noisy)
+
+def _exact_prob(p,noisy,gates=1):
+    """Returns the probability of a `1` output from a single qubit that would give `1` with probability `p` without noise. Works for floats or NumPy arrays of probabilities (and of `gates`).
+    
+    The simple noise model of `get_noise()` applies depolarizing noise after each of the `gates` single qubit gates, followed by the bit flip of the measurement. Each depolarizing error shrinks the Bloch vector by the same factor in all directions, and so commutes with the gates, which means only the number of gates matters. Tools that cannot count their gates use the default of one, which makes their noise approximate. Noise models from real devices (when `noisy` is a string) cannot be used, and raise a ValueError."""
+    if noisy:
+        if type(noisy) is str:
+            raise ValueError("Noise models from real devices cannot be used with device='exact'. Use noisy=True or a float instead.")
+        p_meas, p_gate1 = _noise_params(noisy)
+        shrink = (1-p_gate1)**gates
+        p = shrink*p + (1-shrink)/2
+        p = (1-p_meas)*p + p_meas*(1-p)
+    return p
+
+def _exact_sample(p,shots):
+    """Returns the fraction of `shots` samples that give `1`, when each does so with probability `p`. Works for floats or NumPy arrays of probabilities."""
+    return np.random.binomial(shots,p)/shots
+
+_callbacks = []
+_calls = threading.local() # the record for the public call being made on each thread, if any
+
+def add_callback(callback):
+    """Registers a function that is called with a dictionary for every job run by the package, and for every call to one of its public functions and methods. See `instrument()` for the contents of these dictionaries. Timings are only taken while at least one callback is registered, so the overhead is negligible otherwise."""
+    global _callbacks
+    _callbacks = _callbacks + [callback] # replaced rather than changed, so that threads iterating over it are unaffected
+
+def remove_callback(callback):
+    """Removes a function registered with `add_callback()`."""
+    global _callbacks
+    _callbacks = [ registered for registered in _callbacks if registered!=callback ]
+
+@contextlib.contextmanager
+def instrument():
+    """Context manager that collects the instrumentation events from within its block into a list, which is given by `with instrument() as events:`. There are two kinds of event.
+    
+    For each job, {'kind':'execute', 'backend', 'circuits', 'cached', 'shots', 'qubits', 'depth', 'phases'} is given. Here 'circuits' is the number of circuits, 'cached' the number of these that were found in `job_cache`, and 'qubits' and 'depth' are the maxima over the circuits. The 'phases' are a dictionary of durations in seconds for 'cache' (lookups), 'transpile' (compiling and sending the job), 'simulation' (waiting for the result) and 'decoding' (extracting the data).
+    
+    For each call to a public function or method, {'kind':'call', 'name', 'seconds', 'executes', 'shots', 'qubits', 'depth', 'phases'} is given. Here 'executes' is the number of jobs, and 'shots', 'qubits' and 'depth' are the maxima over these jobs. The 'phases' are 'construction' (up to the first job), the summed phases of the jobs, and then 'decoding' or 'plotting' for everything after the last job. When jobs are merged by `scheduler`, their time is given as 'queued'. Calls made from within another are included in the outer call, rather than reported separately."""
+    events = []
+    add_callback(events.append)
+    try:
+        yield events
+    finally:
+        remove_callback(events.append)
+
+def _emit(event):
+    # gives the event to each callback, without letting a broken callback stop the program
+    for callback in _callbacks:
+        try:
+            callback(event)
+        except Exception as error:
+            warnings.warn('Instrumentation callback failed: '+repr(error))
+
+def _circuit_size(circuits):
+    # returns the maximum number of qubits and depth for a list of circuits
+    qubits = max( sum( register.size for register in circuit.qregs ) for circuit in circuits )
+    depth = max( circuit.depth() for circuit in circuits )
+    return qubits, depth
+
+def _instrument(name,after='decoding'):
+    """Decorator that reports the calls to a public function or method to the instrumentation callbacks. The time after the last job is given as the phase `after`."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            if not _callbacks or getattr(_calls,'current',None) is not None:
+                return function(*args,**kwargs)
+            call = {'kind':'call','name':name,'executes':0,'shots':0,'qubits':0,'depth':0,'phases':collections.OrderedDict(),'first':None,'last':None}
+            _calls.current = call
+            start = time.perf_counter()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                end = time.perf_counter()
+                _calls.current = None
+                first = call.pop('first') or end
+                last = call.pop('last') or start
+                phases = collections.OrderedDict()
+                if call['executes']:
+                    phases['construction'] = first-start
+                phases.update(call['phases'])
+                phases[after] = phases.get(after,0) + end-last
+                call['phases'] = phases
+                call['seconds'] = end-start
+                _emit(call)
+        return wrapper
+    return decorator
+
+def _prob_of_one(stats,shots):
+    """Returns the fraction of `shots` for which a single qubit gave `1`, given the counts dictionary."""
+    if '1' in stats:
+        return stats['1']/shots
+    else:
+        return 0
+
+
+class _batch_result():
+    """Holds the parts of a qiskit result that are used in this package (counts, memory and statevector) for a list of circuits. Unlike the result itself, this can be split between the callers whose circuits were run together in a single job."""
+    
+    def __init__(self,circuits,data,event=None):
+        self.circuits = circuits
+        self.data = data # a dictionary for each circuit, with whichever of 'counts', 'memory' and 'statevector' were available
+        self.event = event # the instrumentation event of the job, if one was made
+        
+    def _entry(self,key,experiment):
+        if experiment is None:
+            j = 0
+        elif type(experiment) is int:
+            j = experiment
+        else:
+            j = [ id(circuit) for circuit in self.circuits ].index(id(experiment))
+        if key not in self.data[j]:
+            raise KeyError('No '+key+' is available for this circuit.')
+        return self.data[j][key]
+        
+    def get_counts(self,experiment=None):
+        """Returns the counts dictionary for the given circuit (or its index). This can be left out when a single circuit was run."""
+        return self._entry('counts',experiment)
+    
+    def get_memory(self,experiment=None):
+        """Returns the list of output strings for each shot of the given circuit (or its index), when `memory=True` was used."""
+        return self._entry('memory',experiment)
+    
+    def get_statevector(self,experiment=None):
+        """Returns the statevector for the given circuit (or its index), for jobs run on the statevector simulator."""
+        return self._entry('statevector',experiment)
+    
+    def subset(self,start,end):
+        """Returns a `_batch_result` for the circuits with indices from `start` up to `end`."""
+        return _batch_result(self.circuits[start:end],self.data[start:end])
+
+
+class result_cache():
+    """Keeps the results of circuits that have already been run, so that running an identical circuit again skips execution entirely. Results are keyed by a hash of the circuit, backend, noise model, shots, memory setting and simulator seed. The `maxsize` most recently used results are kept in memory, and results can also be written to an on-disk store in the directory `path`, which is kept below `max_bytes` by deleting the least recently used files.
+    
+    The cache is off by default, and is turned on with `job_cache.enable()`. Note that a repeated circuit then gives the same samples as the first time it was run, unless the seed has changed. The attributes `hits` and `misses` count how many circuits were found in the cache, and how many had to be run."""
+    
+    def __init__(self,maxsize=256,path=None,max_bytes=2**28):
+        """maxsize = Maximum number of results kept in memory.
+        path = Directory for the on-disk store. For `path=None`, results are kept only in memory.
+        max_bytes = Maximum total size of the files in the on-disk store."""
+        self.maxsize = maxsize
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self._noise_digests = collections.OrderedDict() # the most recently used noise models and their digests
+        self._lock = threading.Lock()
+        
+    def enable(self,path=None,maxsize=None,max_bytes=None):
+        """Switches the cache on. Any kwargs given replace the values set when the cache was created."""
+        if path is not None:
+            self.path = path
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if self.path:
+            os.makedirs(self.path,exist_ok=True)
+        self.enabled = True
+        
+    def disable(self):
+        """Switches the cache off. Stored results are kept, and are used again if the cache is switched back on."""
+        self.enabled = False
+        
+    def clear(self,disk=False):
+        """Forgets all results kept in memory, and resets the counters.
+        
+        disk = Whether to also delete the files of the on-disk store."""
+        with self._lock:
+            self.entries.clear()
+            self._noise_digests.clear()
+            self.hits = 0
+            self.misses = 0
+            if disk and self.path and os.path.isdir(self.path):
+                for filename in os.listdir(self.path):
+                    if filename.endswith('.pkl'):
+                        os.remove(os.path.join(self.path,filename))
+    
+    def _noise_digest(self,noise_model):
+        # noise models from `get_noise()` are not modified, so the digest for each is worked out only once
+        if noise_model is None:
+            return 'None'
+        with self._lock:
+            if id(noise_model) in self._noise_digests:
+                self._noise_digests.move_to_end(id(noise_model))
+                return self._noise_digests[id(noise_model)][1]
+        try:
+            digest = json.dumps(noise_model.to_dict(),sort_keys=True,default=str)
+        except:
+            digest = str(noise_model)
+        with self._lock:
+            # the model itself is kept along with its digest, so that its id is not reused by another object
+            self._noise_digests[id(noise_model)] = (noise_model,digest)
+            # only as many as `registry` keeps are needed, so that forgotten models can be freed
+            while len(self._noise_digests)>registry.maxsize:
+                self._noise_digests.popitem(last=False)
+        return digest
+        
+    def key(self,circuit,backend,noise_model=None,shots=1024,memory=False,seed=None):
+        """Returns the hash used as the key for the result of the given circuit, with the given job settings."""
+        qasm = circuit.qasm()
+        # registers are automatically given unique names, so they are renamed by order of appearance to let identical circuits match
+        registers = re.findall(r'^[qc]reg (\w+)\[',qasm,flags=re.M)
+        names = dict( (name,'r'+str(j)) for j,name in enumerate(registers) )
+        if names:
+            qasm = re.sub(r'\b('+'|'.join(map(re.escape,names))+r')\[',lambda match: names[match.group(1)]+'[',qasm)
+        digest = hashlib.sha256()
+        for part in [qasm,backend.name(),self._noise_digest(noise_model),str(shots),str(memory),str(seed)]:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def _file(self,key):
+        return os.path.join(self.path,key+'.pkl')
+    
+    def get(self,key):
+        """Returns the stored result data for `key`, or None if there is none. The hit and miss counters are updated."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            elif self.path and os.path.exists(self._file(key)):
+                try:
+                    with open(self._file(key),'rb') as file:
+                        entry = pickle.load(file)
+                    os.utime(self._file(key)) # marks the file as recently used
+                    self._remember(key,entry)
+                except: # a file being written by another process, or a corrupted one, counts as a miss
+                    entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+        
+    def put(self,key,entry):
+        """Stores the result data `entry` for `key`."""
+        with self._lock:
+            self._remember(key,entry)
+            if self.path:
+                with open(self._file(key),'wb') as file:
+                    pickle.dump(entry,file,protocol=pickle.HIGHEST_PROTOCOL)
+                self._evict_files()
+        
+    def _remember(self,key,entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries)>self.maxsize:
+            self.entries.popitem(last=False) # forget the least recently used entry
+        
+    def _evict_files(self):
+        # deletes the least recently used files until the on-disk store fits in `max_bytes`
+        files = []
+        for filename in os.listdir(self.path):
+            if filename.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.path,filename))
+                files.append( (stat.st_mtime,stat.st_size,filename) )
+        total = sum( size for (mtime,size,filename) in files )
+        for (mtime,size,filename) in sorted(files):
+            if total<=self.max_bytes:
+                break
+            os.remove(os.path.join(self.path,filename))
+            total -= size
+
+
+job_cache = result_cache()
+
+_seed = None
+
+def set_seed(seed):
+    """Fixes the seed used by the simulators, as well as the random number generators of NumPy and Python, so that runs can be repeated exactly. Use `seed=None` to go back to unseeded runs."""
+    global _seed
+    _seed = seed
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def _run_batch(circuits,backend,noise_model=None,shots=1024,memory=False,cache=True):
+    """Runs a list of circuits as a single job, and returns a `_batch_result`. Use `_execute()` instead, which allows the job to be merged with those of other callers. When `job_cache` is enabled, only the circuits whose results are not already stored are run (unless `cache=False`)."""
+    timed = bool(_callbacks)
+    if timed:
+        phases = collections.OrderedDict()
+        clock = time.perf_counter()
+    data = [None]*len(circuits)
+    if cache and job_cache.enabled:
+        keys = [ job_cache.key(circuit,backend,noise_model,shots,memory,_seed) for circuit in circuits ]
+        data = [ job_cache.get(key) for key in keys ]
+        if timed:
+            phases['cache'] = time.perf_counter()-clock
+            clock = time.perf_counter()
+    missing = [ j for j in range(len(circuits)) if data[j] is None ]
+    if missing:
+        to_run = [ circuits[j] for j in missing ]
+        # results are looked up by circuit name, so names must be unique within the job
+        names = set()
+        for circuit in to_run:
+            if circuit.name in names:
+                circuit.name += '_'+str(len(names))
+            names.add(circuit.name)
+        try:
+            # with noise, every gate is unrolled into the gates that the noise model adds its errors to (u1, u2, u3 and cx for `get_noise()`)
+            basis_gates = noise_model.basis_gates if noise_model is not None else None
+            job = execute(to_run, backend=backend, noise_model=noise_model, basis_gates=basis_gates, shots=shots, memory=memory, seed=_seed)
+        except:
+            job = execute(to_run, backend=backend, shots=shots, memory=memory, seed=_seed)
+        if timed:
+            phases['transpile'] = time.perf_counter()-clock
+            clock = time.perf_counter()
+        result = job.result()
+        if timed:
+            phases['simulation'] = time.perf_counter()-clock
+            clock = time.perf_counter()
+        statevector = 'statevector' in backend.name()
+        for j in missing:
+            entry = {}
+            if statevector:
+                entry['statevector'] = result.get_statevector(circuits[j])
+            else:
+                entry['counts'] = result.get_counts(circuits[j])
+                if memory:
+                    try:
+                        entry['memory'] = result.get_memory(circuits[j])
+                    except: # not all backends support memory
+                        pass
+            data[j] = entry
+            if cache and job_cache.enabled:
+                job_cache.put(keys[j],entry)
+        if timed:
+            phases['decoding'] = time.perf_counter()-clock
+    event = None
+    if timed:
+        qubits, depth = _circuit_size(circuits)
+        event = {'kind':'execute','backend':backend.name(),'circuits':len(circuits),'cached':len(circuits)-len(missing),'shots':shots,'qubits':qubits,'depth':depth,'phases':phases}
+        _emit(event)
+    return _batch_result(circuits,data,event)
+
+
+class job_scheduler():
+    """Collects the circuits submitted by many objects and threads within a short time window, and runs them together. A single job is run for each combination of backend, noise model, number of shots and memory setting, and the results are then routed back to each caller. This raises throughput when many small requests are made at once, such as from many game sessions in one process.
+    
+    The scheduler is off by default, in which case every request runs its own job immediately. Use `scheduler.enable()` to switch it on."""
+    
+    def __init__(self,window=0.005):
+        """window = Time in seconds for which submitted circuits are collected before they are run."""
+        self.window = window
+        self.enabled = False
+        self.jobs = 0 # number of jobs run so far
+        self._pending = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._timer = None
+        
+    def enable(self,window=None):
+        """Switches the scheduler on, so that requests are merged.
+        
+        window = If given, replaces the current time window (in seconds)."""
+        if window is not None:
+            self.window = window
+        self.enabled = True
+        
+    def disable(self):
+        """Switches the scheduler off, after running anything that is still pending."""
+        self.enabled = False
+        self.flush()
+        
+    def submit(self,circuits,backend,noise_model=None,shots=1024,memory=False):
+        """Adds a circuit (or list of circuits) to the next job for the given backend and settings. Returns a `concurrent.futures.Future`, whose result is a `_batch_result` for the submitted circuits only."""
+        if type(circuits) is not list:
+            circuits = [circuits]
+        future = concurrent.futures.Future()
+        key = (id(backend),id(noise_model),shots,memory)
+        with self._lock:
+            if key not in self._pending:
+                self._pending[key] = (backend,noise_model,shots,memory,[])
+            self._pending[key][4].append((circuits,future))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window,self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+    
+    def flush(self):
+        """Runs everything that has been submitted so far, without waiting for the end of the time window."""
+        with self._lock:
+            pending = self._pending
+            self._pending = collections.OrderedDict()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for (backend,noise_model,shots,memory,requests) in pending.values():
+            circuits = [ circuit for (request,future) in requests for circuit in request ]
+            try:
+                result = _run_batch(circuits,backend,noise_model,shots,memory)
+                self.jobs += 1
+            except Exception as error:
+                for (request,future) in requests:
+                    future.set_exception(error)
+                continue
+            start = 0
+            for (request,future) in requests:
+                future.set_result( result.subset(start,start+len(request)) )
+                start += len(request)
+        
+    def run(self,circuits,backend,noise_model=None,shots=1024,memory=False):
+        """Blocking version of `submit()`, which waits for the job and returns the `_batch_result`."""
+        return self.submit(circuits,backend,noise_model,shots,memory).result()
+    
+    async def run_async(self,circuits,backend,noise_model=None,shots=1024,memory=False):
+        """Awaitable version of `submit()`, which returns the `_batch_result`."""
+        return await asyncio.wrap_future( self.submit(circuits,backend,noise_model,shots,memory) )
+
+
+scheduler = job_scheduler()
+
+def _execute(circuits,backend,noise_model=None,shots=1024,memory=False,cache=True):
+    """Runs a circuit (or list of circuits) and returns a `_batch_result`. If `noise_model` is not supported by the backend, it is ignored. When `scheduler` is enabled, the circuits are merged with those of other callers. Use `cache=False` for jobs whose results must be fresh each time, which are then neither cached nor merged."""
+    if type(circuits) is not list:
+        circuits = [circuits]
+    call = getattr(_calls,'current',None)
+    if call is not None:
+        start = time.perf_counter()
+    if not cache:
+        result = _run_batch(circuits,backend,noise_model,shots,memory,cache=False)
+    elif scheduler.enabled:
+        result = scheduler.run(circuits,backend,noise_model,shots,memory)
+    else:
+        result = _run_batch(circuits,backend,noise_model,shots,memory)
+    if call is not None:
+        # add the job to the record of the public call that made it
+        end = time.perf_counter()
+        call['first'] = call['first'] or start
+        call['last'] = end
+        call['executes'] += 1
+        if result.event is not None:
+            phases = result.event['phases']
+            qubits, depth = result.event['qubits'], result.event['depth']
+        else: # run on the scheduler's thread
+            phases = {'queued':end-start}
+            qubits, depth = _circuit_size(circuits)
+        for phase in phases:
+            call['phases'][phase] = call['phases'].get(phase,0) + phases[phase]
+        call['shots'] = max(call['shots'],shots)
+        call['qubits'] = max(call['qubits'],qubits)
+        call['depth'] = max(call['depth'],depth)
+    return result
+
+async def _execute_async(circuits,backend,noise_model=None,shots=1024,memory=False):
+    """Awaitable version of `_execute()`. Without the scheduler, the job is run in the default executor of the event loop."""
+    if type(circuits) is not list:
+        circuits = [circuits]
+    if scheduler.enabled:
+        return await scheduler.run_async(circuits,backend,noise_model,shots,memory)
+    else:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None,_run_batch,circuits,backend,noise_model,shots,memory)
+
     
 class ladder:
     """An integer implemented on a single qubit. Addition and subtraction are implemented via partial NOT gates."""
@@ -79,33 +644,128 @@ class ladder:
         self.qr = QuantumRegister(1) # declare our single qubit
         self.cr = ClassicalRegister(1) # declare a single bit to hold the result
         self.qc = QuantumCircuit(self.qr, self.cr) # combine them in an empty quantum circuit
+        self.angle = 0 # total angle of the rx rotations applied to the qubit, used when device='exact'
+        self.gates = 0 # number of rx gates, each of which adds noise
         
     def add(self,delta):
         """Changes value of ladder object by the given amount `delta`. This is initially done by addition, but it changes to subtraction once the maximum value of `d` is reached. It will then change back to addition once 0 is reached, and so on.
         
         delta = Amount by which to change the value of the ladder object. Can be int or float."""
         self.qc.rx(np.pi*delta/self.d,self.qr[0])
+        self.angle += np.pi*delta/self.d
+        self.gates += 1
         
+    @_instrument('ladder.value')
     def value(self,device='qasm_simulator',noisy=False,shots=1024):
         """Returns the current version of the ladder operator as an int. If floats have been added to this value, the sum of all floats added thus far are rounded.
         
-        device = A string specifying a backend. The noisy behaviour from a real device will result in some randomness in the value given, and can lead to the reported value being less than the true value on average. These effects will be more evident for high `d`.
+        device = A string specifying a backend. The noisy behaviour from a real device will result in some randomness in the value given, and can lead to the reported value being less than the true value on average. These effects will be more evident for high `d`. For device='exact', no job is run. Instead the probability is calculated directly from the angle of the qubit, and the shots are sampled with NumPy. Noise from `noisy=True` or a float is included exactly, with a depolarizing error for each `add()`.
         shots = Number of shots used when extracting results from the qubit. A low value will result in randomness in the value given. This should be neglible when the value is a few orders of magnitude greater than `d`. """  
+        if device=='exact':
+            p = _exact_sample( _exact_prob(np.sin(self.angle/2)**2,noisy,self.gates), shots )
+        else:
+            result = _execute(self._circuit(),get_backend(device),get_noise(noisy),shots)
+            p = _prob_of_one(result.get_counts(),shots)
+        return self._value(p)
+    
+    async def value_async(self,device='qasm_simulator',noisy=False,shots=1024):
+        """Awaitable version of `value()`, with the same kwargs. When `scheduler` is enabled, the circuit is run in the same job as those of other callers."""
+        if device=='exact':
+            return self.value(device,noisy,shots)
+        result = await _execute_async(self._circuit(),get_backend(device),get_noise(noisy),shots)
+        return self._value( _prob_of_one(result.get_counts(),shots) )
+    
+    def _circuit(self):
+        # returns a copy of self.qc with the measurement added
         temp_qc = copy.deepcopy(self.qc)
         temp_qc.barrier(self.qr)
         temp_qc.measure(self.qr,self.cr)
-        try:
-            job = execute(temp_qc,backend=get_backend(device),noise_model=get_noise(noisy),shots=shots)
-        except:
-            job = execute(temp_qc,backend=get_backend(device),shots=shots)
-        if '1' in job.result().get_counts():
-            p = job.result().get_counts()['1']/shots
-        else:
-            p = 0
+        return temp_qc
+    
+    def _value(self,p):
+        # converts the probability of a `1` output into the value
         delta = round(2*np.arcsin(np.sqrt(p))*self.d/np.pi)
         return int(delta)
 
+
+class ladder_array:
+    """A collection of `num` ladder objects, which can be changed and read out together. The angle of each qubit is stored as an element of a NumPy array, and all values are extracted with a single job."""
+    
+    def __init__(self,num,d):
+        """Create a new ladder_array object. The `value` of each element is an int that can be 0 at minimum and `d` at maximum. These values are initialized to 0.
+        
+        num = Number of ladders.
+        d = Maximum value for the ladders. Can be an int for all to have the same maximum, or an array of `num` ints."""
+        self.num = num
+        self.d = np.asarray(d)
+        self.angles = np.zeros(num) # total angle of the rx rotations applied to the qubit of each ladder
+        
+    def __len__(self):
+        return self.num
+        
+    def add(self,delta):
+        """Changes the value of each ladder by the given amount, in the same way as `ladder.add()`.
+        
+        delta = Amount by which to change the values. Can be an int or float to change all ladders by the same amount, or an array of `num` ints or floats."""
+        self.angles += np.pi*np.asarray(delta)/self.d
+        
+    @_instrument('ladder_array.value')
+    def value(self,device='qasm_simulator',noisy=False,shots=1024):
+        """Returns the current values of all ladders as a NumPy array of ints. For details of kwargs, see `ladder.value()`.
+        
+        For device='exact', all values are calculated in a single vectorized pass. Otherwise all the circuits are run in a single job."""
+        if device=='exact':
+            p = _exact_sample( _exact_prob(np.sin(self.angles/2)**2,noisy), shots )
+        else:
+            batch = []
+            for angle in self.angles:
+                qr = QuantumRegister(1)
+                cr = ClassicalRegister(1)
+                qc = QuantumCircuit(qr, cr)
+                qc.rx(angle,qr[0])
+                qc.barrier(qr)
+                qc.measure(qr,cr)
+                batch.append(qc)
+            result = _execute(batch,get_backend(device),get_noise(noisy),shots)
+            p = np.zeros(self.num)
+            for j in range(self.num):
+                p[j] = _prob_of_one(result.get_counts(j),shots)
+        delta = np.round(2*np.arcsin(np.sqrt(p))*self.d/np.pi)
+        return delta.astype(int)
+
     
+def _twobit_prepare(qc,q,basis,b):
+    """Adds the gates to `qc` that store the boolean `b` on qubit `q` using the measurement type `basis` ('X', 'Y' or 'Z'). The Bloch vector of the resulting state is returned."""
+    if basis=='Y':
+        qc.h(q)
+        if b:
+            qc.sdg(q)
+        else:
+            qc.s(q)
+    elif basis=='X':
+        if b:
+            qc.x(q)
+        qc.h(q)
+    elif b:
+        qc.x(q)
+    bloch = [0,0,0]
+    bloch['XYZ'.index(basis)] = 1-2*bool(b) # pointing along the axis for False, and against it for True
+    return tuple(bloch)
+
+def _twobit_measure(qc,q,basis):
+    """Adds the gates to `qc` that rotate qubit `q` so that a standard measurement reads out the measurement type `basis` ('X', 'Y' or 'Z')."""
+    if basis=='X':
+        qc.h(q)
+    elif basis=='Y':
+        qc.sdg(q)
+        qc.h(q)
+
+# numbers of gates added by `_twobit_prepare` (indexed by the axis of the basis and the boolean) and `_twobit_measure` (indexed by the axis), used for the noise when device='exact'
+# each is unrolled into a single u1, u2 or u3 gate when jobs are run with noise (see `_run_batch()`), and so gets a single depolarizing error
+_twobit_prepare_gates = np.array([[1,2],[2,2],[0,1]])
+_twobit_measure_gates = np.array([1,2,0])
+
+
 class twobit:
     """An object that can store a single boolean value, but can do so in two incompatible ways. It is implemented on a single qubit using two complementary measurement bases."""
     
@@ -121,43 +781,47 @@ class twobit:
         
         Note that `basis='Y'` (and arbitrary `b`) will result in the twobit giving a random result for both 'X' and 'Z' (and similarly for any one versus the remaining two). """
         self.qc = QuantumCircuit(self.qr, self.cr)
-        if 'Y' in state:
-            self.qc.h(self.qr[0])
-            if state['Y']:
-                self.qc.sdg(self.qr[0])
-            else:
-                self.qc.s(self.qr[0])
-        elif 'X' in state:
-            if state['X']:
-                self.qc.x(self.qr[0])
-            self.qc.h(self.qr[0])
-        elif 'Z' in state:
-            if state['Z']:
-                self.qc.x(self.qr[0])
+        # the Bloch vector of the qubit is also tracked, for use when device='exact'
+        self.bloch = (0,0,1)
+        self.gates = 0
+        for basis in ['Y','X','Z']:
+            if basis in state:
+                self.bloch = _twobit_prepare(self.qc,self.qr[0],basis,state[basis])
+                self.gates = _twobit_prepare_gates['XYZ'.index(basis),int(bool(state[basis]))]
+                break
                 
+    @_instrument('twobit.value')
     def value (self,basis,device='qasm_simulator',noisy=False,shots=1024,mitigate=True):
         """Extracts the boolean value for the given measurement type. The twobit is also reinitialized to ensure that the same value would if the same call to `measure()` was repeated.
         
         basis = 'X' or 'Z', specifying the desired measurement type.
-        device = A string specifying a backend. The noisy behaviour from a real device will result in some randomness in the value given, even if it has been set to a definite value for a given measurement type. This effect can be reduced using `mitigate=True`.
+        device = A string specifying a backend. The noisy behaviour from a real device will result in some randomness in the value given, even if it has been set to a definite value for a given measurement type. This effect can be reduced using `mitigate=True`. For device='exact', no job is run. Instead the probability is calculated directly from the Bloch vector of the qubit, and the shots are sampled with NumPy. Noise from `noisy=True` or a float is included exactly, with a depolarizing error for each gate used to prepare and measure the qubit.
         shots = Number of shots used when extracting results from the qubit. A value of greater than 1 only has any effect for `mitigate=True`, in which case larger values of `shots` allow for better mitigation.
         mitigate = Boolean specifying whether mitigation should be applied. If so the values obtained over `shots` samples are considered, and the fraction which output `True` is calculated. If this is more than 90%, measure will return `True`. If less than 10%, it will return `False`, otherwise it returns a random value using the fraction as the probability."""
-        if basis=='X':
-            self.qc.h(self.qr[0])
-        elif basis=='Y':
-            self.qc.sdg(self.qr[0])
-            self.qc.h(self.qr[0])
+        if device=='exact':
+            gates = self.gates + _twobit_measure_gates['XYZ'.index(basis)]
+            p = _exact_sample( _exact_prob((1-self.bloch['XYZ'.index(basis)])/2,noisy,gates), shots )
+        else:
+            result = _execute(self._circuit(basis),get_backend(device),get_noise(noisy),shots)
+            p = _prob_of_one(result.get_counts(),shots)
+        return self._value(basis,p,mitigate)
+    
+    async def value_async(self,basis,device='qasm_simulator',noisy=False,shots=1024,mitigate=True):
+        """Awaitable version of `value()`, with the same kwargs. When `scheduler` is enabled, the circuit is run in the same job as those of other callers."""
+        if device=='exact':
+            return self.value(basis,device,noisy,shots,mitigate)
+        result = await _execute_async(self._circuit(basis),get_backend(device),get_noise(noisy),shots)
+        return self._value( basis, _prob_of_one(result.get_counts(),shots), mitigate )
+    
+    def _circuit(self,basis):
+        # adds the measurement for the given basis to self.qc, and returns it
+        _twobit_measure(self.qc,self.qr[0],basis)
         self.qc.barrier(self.qr)
         self.qc.measure(self.qr,self.cr)
-        try:
-            job = execute(self.qc, backend=get_backend(device), noise_model=get_noise(noisy), shots=shots)
-        except:
-            job = execute(self.qc, backend=get_backend(device), shots=shots)
-        stats = job.result().get_counts()
-        if '1' in stats:
-            p = stats['1']/shots
-        else:
-            p = 0
+        return self.qc
+    
+    def _value(self,basis,p,mitigate):
+        # turns the probability of a `1` output into the measured value, and reinitializes the twobit accordingly
         if mitigate: # if p is close to 0 or 1, just make it 0 or 1
             if p<0.1:
                 p = 0
@@ -180,7 +844,69 @@ class twobit:
         """Extracts the boolean value via the X basis. For details of kwargs, see `value()`."""
         return self.value('Z',device=device,noisy=noisy,shots=shots,mitigate=mitigate)
     
+
+
+class twobit_array:
+    """A collection of `num` twobit objects, which can all be measured together. The Bloch vectors of the qubits are stored as a NumPy array, and all values are extracted with a single job."""
+    
+    def __init__(self,num):
+        """Create a twobit_array object, with each element initialized to give a random boolean value for both measurement types."""
+        self.num = num
+        self.prepare('Y',False)
+        
+    def __len__(self):
+        return self.num
+        
+    def prepare(self,bases,values):
+        """Prepares all twobits, with the booleans `values` stored using the measurement types `bases`, in the same way as `twobit.prepare()`.
+        
+        bases = Either 'X', 'Y' or 'Z' to use the same measurement type for all, or a string or list with one of these for each twobit.
+        values = Either a single boolean to use for all, or a list or array with one for each twobit."""
+        axes = np.array( ['XYZ'.index(basis) for basis in bases] ) * np.ones(self.num,dtype=int)
+        values = np.asarray(values,dtype=bool) * np.ones(self.num,dtype=bool)
+        # Bloch vectors point along the axis for False, and against it for True
+        self.bloch = np.zeros((self.num,3))
+        self.bloch[np.arange(self.num),axes] = 1-2*values
+        
+    @_instrument('twobit_array.value')
+    def value(self,bases,device='qasm_simulator',noisy=False,shots=1024,mitigate=True):
+        """Extracts the boolean values for the given measurement types, and returns them as a NumPy array. The twobits are then reinitialized to ensure that the same values would be given if the same call was repeated. For details of kwargs, see `twobit.value()`.
+        
+        bases = Either 'X', 'Y' or 'Z' to use the same measurement type for all, or a string or list with one of these for each twobit.
+        
+        For device='exact', all values are calculated in a single vectorized pass. Otherwise all the circuits are run in a single job."""
+        axes = np.array( ['XYZ'.index(basis) for basis in bases] ) * np.ones(self.num,dtype=int)
+        if device=='exact':
+            # the gates are those of the circuits below
+            prepared = np.argmax(np.abs(self.bloch),axis=1)
+            gates = _twobit_prepare_gates[prepared,(self.bloch[np.arange(self.num),prepared]<0).astype(int)] + _twobit_measure_gates[axes]
+            p = _exact_sample( _exact_prob((1-self.bloch[np.arange(self.num),axes])/2,noisy,gates), shots )
+        else:
+            batch = []
+            for j in range(self.num):
+                qr = QuantumRegister(1)
+                cr = ClassicalRegister(1)
+                qc = QuantumCircuit(qr, cr)
+                # each twobit is in an eigenstate of one of the measurement types, as given by its Bloch vector
+                axis = np.argmax(np.abs(self.bloch[j]))
+                _twobit_prepare(qc,qr[0],'XYZ'[axis],self.bloch[j,axis]<0)
+                _twobit_measure(qc,qr[0],'XYZ'[axes[j]])
+                qc.barrier(qr)
+                qc.measure(qr,cr)
+                batch.append(qc)
+            result = _execute(batch,get_backend(device),get_noise(noisy),shots)
+            p = np.zeros(self.num)
+            for j in range(self.num):
+                p[j] = _prob_of_one(result.get_counts(j),shots)
+        if mitigate: # if p is close to 0 or 1, just make it 0 or 1
+            p = np.where(p<0.1,0,np.where(p>0.9,1,p))
+        measured_values = ( p>np.random.random(self.num) )
+        self.prepare(['XYZ'[axis] for axis in axes],measured_values)
+        
+        return measured_values
+    
         
+@_instrument('bell_correlation')
 def bell_correlation (basis,device='qasm_simulator',noisy=False,shots=1024):
     """Prepares a rotated Bell state of two qubits. Measurement is done in the specified basis for each qubit. The fraction of results for which the two qubits agree is returned.
     
@@ -188,6 +914,16 @@ def bell_correlation (basis,device='qasm_simulator',noisy=False,shots=1024):
     device = A string specifying a backend. The noisy behaviour from a real device will result in the correlations being less strong than in the ideal case.
     shots = Number of shots used when extracting results from the qubit. For shots=1, the returned value will randomly be 0 (if the results for the two qubits disagree) or 1 (if they agree). For large shots, the returned value will be probability for this random process.
     """
+    result = _execute(_bell_circuit(basis),get_backend(device),get_noise(noisy),shots,memory=True)
+    return _bell_output(result,shots)
+
+async def bell_correlation_async (basis,device='qasm_simulator',noisy=False,shots=1024):
+    """Awaitable version of `bell_correlation()`, with the same kwargs. When `scheduler` is enabled, the circuit is run in the same job as those of other callers."""
+    result = await _execute_async(_bell_circuit(basis),get_backend(device),get_noise(noisy),shots,memory=True)
+    return _bell_output(result,shots)
+
+def _bell_circuit(basis):
+    """Returns the circuit for `bell_correlation()`, with the measurements for the given basis."""
     qr = QuantumRegister(2)
     cr = ClassicalRegister(2)
     qc = QuantumCircuit(qr,cr)
@@ -205,12 +941,11 @@ def bell_correlation (basis,device='qasm_simulator',noisy=False,shots=1024):
 
     qc.barrier(qr)
     qc.measure(qr,cr)
-    
-    try:
-        job = execute(qc, backend=get_backend(device), noise_model=get_noise(noisy), shots=shots, memory=True)
-    except:
-        job = execute(qc, backend=get_backend(device), shots=shots, memory=True)
-    stats = job.result().get_counts()
+    return qc
+
+def _bell_output(result,shots):
+    """Returns the output of `bell_correlation()` for the result of running its circuit."""
+    stats = result.get_counts()
     
     P = 0
     for string in stats:
@@ -218,13 +953,76 @@ def bell_correlation (basis,device='qasm_simulator',noisy=False,shots=1024):
         if string in ['00','11']:
             P += p
             
-    return {'P':P, 'samples':job.result().get_memory() }
+    return {'P':P, 'samples':result.get_memory() }
+
+def _bernoulli_positions(n,p):
+    """Returns the sorted positions, out of `n`, at which an event with probability `p` occurs. The gaps between events are drawn from the geometric distribution, so the cost is proportional to the number of events rather than to `n`."""
+    positions = []
+    last = -1
+    while True:
+        found = last + np.cumsum( np.random.geometric(p,size=int(1.1*n*p)+16) )
+        positions.append( found[found<n] )
+        if found[-1]>=n:
+            return np.concatenate(positions)
+        last = found[-1]
+
+def _flip_bits(bits,noisy):
+    """Flips each element of a NumPy array of bits independently, with the probability that a measured bit is flipped by the simple noise model of `get_noise()`. The array is changed in place and returned."""
+    if noisy:
+        flat = bits.reshape(-1)
+        flat[ _bernoulli_positions(flat.size,_exact_prob(0,noisy)) ] ^= 1
+        if not np.shares_memory(flat,bits): # reshaping made a copy
+            bits[...] = flat.reshape(bits.shape)
+    return bits
+
+def _count_rows(bits):
+    """Returns a dictionary with the number of times each row of a 2D NumPy array of bits occurs. The keys are the rows written as bit strings."""
+    # rows are packed into bytes to count them, which is much faster than comparing arrays for long rows
+    packed_counts = collections.Counter( row.tobytes() for row in np.packbits(bits,axis=1) )
+    if not packed_counts:
+        return {}
+    # the distinct rows are unpacked and decoded together
+    num = bits.shape[1]
+    rows = np.unpackbits( np.frombuffer(b''.join(packed_counts),dtype=np.uint8).reshape(len(packed_counts),-1), axis=1 )[:,:num]
+    text = (rows+ord('0')).tobytes().decode('ascii')
+    return dict( ( text[j*num:(j+1)*num], count ) for j,count in enumerate(packed_counts.values()) )
+
+def _exact_bitstrings(strings,bias,noisy,shots,chunk=2**22):
+    """Samples the output of `bitstring_superposer` for a single list of strings of equal length, without running a job. Returns a dictionary with the fraction of shots for which each string occurred.
+    
+    The number of shots for each string is drawn in a single multinomial sample, so without noise the cost does not depend on the number of shots or the length of the strings. With noise, the bits of each shot are made and flipped in chunks of about `chunk` bits, to keep the memory used bounded."""
+    num = len(strings[0])
+    if len(strings)==2 and num>1: # strings[0] occurs with probability bias, and strings[1] otherwise
+        probs = [bias,1-bias]
+    else: # each of the given strings is equally likely (which is all strings if all are given)
+        probs = [1/len(strings)]*len(strings)
+    counts = collections.Counter()
+    for string,count in zip(strings,np.random.multinomial(shots,probs)):
+        counts[string] += int(count)
+    
+    if noisy:
+        noiseless = counts
+        counts = collections.Counter()
+        rows = max(1,chunk//num)
+        for string in noiseless:
+            bits = np.frombuffer(string.encode('ascii'),dtype=np.uint8) - ord('0')
+            for start in range(0,noiseless[string],rows):
+                block = np.tile( bits, (min(rows,noiseless[string]-start),1) )
+                counts.update( _count_rows( _flip_bits(block,noisy) ) )
+    
+    stats = {}
+    for string in counts:
+        if counts[string]:
+            stats[string] = counts[string]/shots
+    return stats
 
+@_instrument('bitstring_superposer')
 def bitstring_superposer (strings,bias=0.5,device='qasm_simulator',noisy=False,shots=1024):
     """Prepares the superposition of the two given n bit strings. The number of qubits used is equal to the length of the string. The superposition is measured, and the process repeated many times. A dictionary with the fraction of shots for which each string occurred is returned.
     
-    string = List of two binary strings. If the list has more than two elements, all but the first two are ignored.
-    device = A string specifying a backend. The noisy behaviour from a real device will result in strings other than the two supplied occuring with non-zero fraction.
+    string = List of binary strings. For two strings, the first occurs with probability `bias` and the second otherwise. For any other number, an equal superposition of the given strings is prepared (and `bias` is ignored).
+    device = A string specifying a backend. The noisy behaviour from a real device will result in strings other than the two supplied occuring with non-zero fraction. For device='exact', no job is run. Instead the shots are sampled directly from the known output distribution using NumPy, which works for strings of any length.
+    noisy = Noise model, as used by `get_noise()`. For device='exact', the simple noise model of `get_noise()` is approximated by independent bit flips, with the error of a single gate and a measurement for each bit. Noise models from real devices cannot be used in this case.
     shots = Number of times the process is repeated to calculate the fractions. For shots=1, only a single randomnly generated bit string is return (as the key of a dict)."""
     
     # make it so that the input is a list of list of strings, even if it was just a list of strings
@@ -241,8 +1039,11 @@ def bitstring_superposer (strings,bias=0.5,device='qasm_simulator',noisy=False,s
         num = 0
         for string in strings:
             num = max(len(string),num)
-        for string in strings:
-            string = '0'*(num-len(string)) + string
+        strings = ['0'*(num-len(string)) + string for string in strings]
+        
+        if device=='exact':
+            batch.append( _exact_bitstrings(strings,bias,noisy,shots) )
+            continue
         
         qr = QuantumRegister(num)
         cr = ClassicalRegister(num)
@@ -251,6 +1052,11 @@ def bitstring_superposer (strings,bias=0.5,device='qasm_simulator',noisy=False,s
         if len(strings)==2**num: # create equal superposition of all if all are asked for
             for n in range(num):
                 qc.h(qr[n])
+        elif len(strings)!=2: # create equal superposition of the given strings
+            # bit j of each string is for qubit j, which is bit j of the index of the statevector
+            probs = np.zeros(2**num)
+            np.add.at(probs,[ int(string[::-1],2) for string in strings ],1/len(strings))
+            qc.initialize(np.sqrt(probs),[ qr[n] for n in range(num) ])
         else: # create superposition of just two
             diff = []
             for bit in range(num):
@@ -273,20 +1079,20 @@ def bitstring_superposer (strings,bias=0.5,device='qasm_simulator',noisy=False,s
         
         batch.append(qc)
 
-    try:
-        job = execute(batch, backend=get_backend(device), noise_model=get_noise(noisy), shots=shots)
-    except:
-        job = execute(batch, backend=get_backend(device), shots=shots)
-    stats_raw_list = []
-    for j in range(len(strings_list)):
-        stats_raw_list.append( job.result().get_counts(batch[j]) )
-
-    stats_list = []
-    for stats_raw in stats_raw_list:
-        stats = {}
-        for string in stats_raw:
-            stats[string[::-1]] = stats_raw[string]/shots
-        stats_list.append(stats)
+    if device=='exact':
+        stats_list = batch
+    else:
+        result = _execute(batch,get_backend(device),get_noise(noisy),shots)
+        stats_raw_list = []
+        for j in range(len(strings_list)):
+            stats_raw_list.append( result.get_counts(j) )
+
+        stats_list = []
+        for stats_raw in stats_raw_list:
+            stats = {}
+            for string in stats_raw:
+                stats[string[::-1]] = stats_raw[string]/shots
+            stats_list.append(stats)
     
     # if only one instance was given, output dict rather than list with a single dict
     if len(stats_list)==1:
@@ -294,7 +1100,47 @@ def bitstring_superposer (strings,bias=0.5,device='qasm_simulator',noisy=False,s
 
     return stats_list
     
-def emoticon_superposer (emoticons,bias=0.5,device='qasm_simulator',noisy=False,shots=1024,figsize=(20,20),encoding=7):
+_agg_figures = {}
+
+def _agg_figure(figsize=None):
+    """Returns a cleared matplotlib figure that is drawn off-screen by the Agg renderer, without pyplot. One figure is kept for each `figsize` and reused, so rendering many images does not create many figures. For `figsize=None`, the default size of matplotlib is used."""
+    if figsize is not None:
+        figsize = tuple(figsize)
+    if figsize not in _agg_figures:
+        fig = figure.Figure(figsize=figsize)
+        backend_agg.FigureCanvasAgg(fig)
+        _agg_figures[figsize] = fig
+    fig = _agg_figures[figsize]
+    fig.clf()
+    return fig
+
+def _render_figure(fig,render):
+    """Returns the contents of an off-screen figure as PNG bytes (for `render='png'`) or as an RGBA NumPy array (for `render='array'`)."""
+    if render=='png':
+        buffer = io.BytesIO()
+        fig.savefig(buffer,format='png')
+        return buffer.getvalue()
+    else:
+        fig.canvas.draw()
+        return np.array(fig.canvas.buffer_rgba())
+
+def _output_file(prefix,extension='png'):
+    """Returns a filename in the 'outputs' directory (which is created if needed) with the given prefix and a timestamp."""
+    os.makedirs('outputs',exist_ok=True)
+    return 'outputs/'+prefix+datetime.datetime.now().strftime("%H:%M:%S %p on %B %d, %Y")+'.'+extension
+
+def _draw_emoticon(fig,ascii_stats):
+    """Draws all the pairs of characters in `ascii_stats` on top of each other, with alpha given by how often each turned up in the output."""
+    ax = fig.add_subplot(111)
+    for char in ascii_stats:
+        try:
+            ax.annotate( char, (0.5,0.5), va="center", ha="center", color = (0,0,0, ascii_stats[char] ), size = 300, family='monospace')
+        except:
+            pass
+    ax.axis('off')
+
+@_instrument('emoticon_superposer',after='plotting')
+def emoticon_superposer (emoticons,bias=0.5,device='qasm_simulator',noisy=False,shots=1024,figsize=(20,20),encoding=7,render='show'):
     """Creates superposition of two emoticons.
     
     A dictionary is returned, which supplies the relative strength of each pair of ascii characters in the superposition. An image representing the superposition, with each pair of ascii characters appearing with an weight that represents their strength in the superposition, is also created.
@@ -302,7 +1148,8 @@ def emoticon_superposer (emoticons,bias=0.5,device='qasm_simulator',noisy=False,
     emoticons = A list of two strings, each of which is composed of two ascii characters, such as [ ";)" , "8)" ].
     device = A string specifying a backend. The noisy behaviour from a real device will result in emoticons other than the two supplied occuring with non-zero strength.
     shots = Number of times the process is repeated to calculate the fractions used as strengths. For shots=1, only a single randomnly generated emoticon is return (as the key of the dict).
-    emcoding = Number of bits used to encode ascii characters."""
+    emcoding = Number of bits used to encode ascii characters.
+    render = How the image is created. For render='show' it is saved in 'outputs' and shown with pyplot. For render='png' or render='array', it is instead rendered off-screen to PNG bytes or an RGBA NumPy array, reusing a single figure for all images, and the output is a tuple of the dictionary and the image (or lists of each). For render=None, no image is made at all."""
     
     # make it so that the input is a list of list of strings, even if it was just a list of strings
     if type(emoticons[0])==str:
@@ -331,40 +1178,72 @@ def emoticon_superposer (emoticons,bias=0.5,device='qasm_simulator',noisy=False,
         stats_list = stats
         
     ascii_stats_list = []
+    images = []
     for stats in stats_list:
-        fig = plt.figure()
-        ax=fig.add_subplot(111)
-        plt.rc('font', family='monospace')
         ascii_stats = {}
         for string in stats:
             char = chr(int( string[0:encoding] ,2)) # get string of the leftmost bits and convert to an ASCII character
             char += chr(int( string[encoding:2*encoding] ,2)) # do the same for string of rightmost bits, and add it to the previous character
-            prob = stats[string] # fraction of shots for which this result occurred
-            ascii_stats[char] = prob
-            # create plot with all characters on top of each other with alpha given by how often it turned up in the output
-            try:
-                plt.annotate( char, (0.5,0.5), va="center", ha="center", color = (0,0,0, prob ), size = 300)
-            except:
-                pass
+            ascii_stats[char] = stats[string] # fraction of shots for which this result occurred
         ascii_stats_list.append(ascii_stats)
 
-        plt.axis('off')
-        plt.savefig('outputs/emoticon_'+datetime.datetime.now().strftime("%H:%M:%S %p on %B %d, %Y")+'.png')
-        plt.show()
+        if render=='show':
+            fig = plt.figure()
+            _draw_emoticon(fig,ascii_stats)
+            plt.savefig(_output_file('emoticon_'))
+            plt.show()
+        elif render:
+            fig = _agg_figure()
+            _draw_emoticon(fig,ascii_stats)
+            images.append( _render_figure(fig,render) )
     
     # if only one instance was given, output dict rather than list with a single dict
     if len(ascii_stats_list)==1:
         ascii_stats_list = ascii_stats_list[0]
+        images = images[0] if images else None
     
-    return ascii_stats_list
+    if render in ['png','array']:
+        return ascii_stats_list, images
+    else:
+        return ascii_stats_list
+
 
+class filename_index():
+    """Assigns a binary code to each of a list of filenames, for use by `image_superposer` and `audio_superposer`. An index can be made once for a large library of files, and then used for any number of superpositions. The list given is not changed.
+    
+    files = Copy of the list of filenames.
+    num = Number of files.
+    bit_num = Number of bits in each code.
+    codes = Dictionary of the code for each filename.
+    padded = Copy of `files` padded with None up to length 2**bit_num, so that every code has an entry."""
+    
+    def __init__(self,all_files):
+        self.files = list(all_files)
+        self.num = len(self.files)
+        self.bit_num = max(1,int(np.ceil( np.log2(self.num) )))
+        self.padded = self.files + [None]*(2**self.bit_num-self.num)
+        self.codes = {}
+        for j,file in enumerate(self.files):
+            self.codes.setdefault( file, format(j,'0'+str(self.bit_num)+'b') ) # for repeated names, the first is used
+    
+    def __len__(self):
+        return self.num
+    
+    def code(self,file):
+        """Returns the binary code for the given filename."""
+        return self.codes[file]
+    
+    def file(self,string):
+        """Returns the filename for the given binary code, or None for codes that are not assigned to a file."""
+        return self.padded[int(string,2)]
 
 def _filename_superposer (all_files,files,bias,device,noisy,shots):
-    """Takes a list of all possible filenames (all_files) as well as a pair to be superposed or list of such pairs (files) and superposes them for a given bias and number of shots on a given device. Output is a dictionary will filenames as keys and the corresponding fractions of shots as target.""" 
+    """Takes a list of all possible filenames or a `filename_index` (all_files) as well as a set of files to be superposed or list of such sets (files) and superposes them for a given bias and number of shots on a given device. Output is a list of dictionaries with filenames as keys and the corresponding fractions of shots as values. Each set can contain any number of the files, and superpositions of two use the bias.""" 
 
-    file_num = len(all_files)
-    bit_num = int(np.ceil( np.log2(file_num) ))
-    all_files += [None]*(2**bit_num-file_num)
+    if isinstance(all_files,filename_index):
+        index = all_files
+    else:
+        index = filename_index(all_files)
     
     # make it so that the input is a list of list of strings, even if it was just a list of strings
     if type(files[0])==str:
@@ -372,14 +1251,7 @@ def _filename_superposer (all_files,files,bias,device,noisy,shots):
     else:
         files_list = files
     
-    strings = []
-    for files in files_list:
-        string = []
-        for file in files:
-            bin4pic = "{0:b}".format(all_files.index(file))
-            bin4pic = '0'*(bit_num-len(bin4pic)) + bin4pic
-            string.append( bin4pic )
-        strings.append(string)
+    strings = [ [ index.codes[file] for file in files ] for files in files_list ]
     
     full_stats = bitstring_superposer(strings,bias=bias,device=device,noisy=noisy,shots=shots)
         
@@ -389,84 +1261,290 @@ def _filename_superposer (all_files,files,bias,device,noisy,shots):
     else:
         full_stats_list = full_stats
         
-    stats_list = []
-    for full_stats in full_stats_list:
-        Z = 0
-        for j in range(file_num):
-            string = "{0:b}".format(j)
-            string = '0'*(bit_num-len(string)) + string
-            if string in full_stats:
-                Z += full_stats[string]    
-        stats = {}
-        for j in range(file_num):
-            string = "{0:b}".format(j)
-            string = '0'*(bit_num-len(string)) + string
-            if string in full_stats:
-                stats[string] = full_stats[string]/Z
-        stats_list.append(stats)
-        
     file_stats_list = []
-    for stats in stats_list:
+    for full_stats in full_stats_list:
+        # results for codes that are not assigned to files (which can occur due to noise) are dropped, and the rest are renormalized
         file_stats = {}
-        for string in stats:
-            file_stats[ all_files[int(string,2)] ] = stats[string]
+        for string in full_stats:
+            file = index.file(string)
+            if file is not None:
+                file_stats[file] = full_stats[string]
+        Z = sum(file_stats.values())
+        for file in file_stats:
+            file_stats[file] = file_stats[file]/Z
         file_stats_list.append(file_stats)
     
     return  file_stats_list
 
 
-def image_superposer (all_images,images,bias=0.5,device='qasm_simulator',noisy=False,shots=1024,figsize=(20,20)):
+class file_cache():
+    """Keeps the decoded contents of files (such as images or audio) as NumPy arrays, so that each file is decoded only once. The `maxsize` most recently used arrays are kept in memory. If a directory `path` is given, decoded arrays are also saved there as .npy files, which are read back memory-mapped. These are then not decoded again in later sessions, and need not all fit in memory. Entries are keyed by the filename along with its modification time and size, so a file that has changed is decoded again."""
+    
+    def __init__(self,maxsize=64,path=None):
+        """maxsize = Maximum number of arrays kept in memory.
+        path = Directory for the decoded .npy files. For `path=None`, arrays are kept only in memory."""
+        self.maxsize = maxsize
+        self.path = path
+        self.arrays = collections.OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self,filename,decode,variant=None):
+        """Returns the decoded array for `filename`, which is made using the function `decode(filename)` if it is not already stored. The array is read-only, since it is shared by all callers.
+        
+        variant = Anything hashable that distinguishes different decodings of the same file, such as a sample rate to convert to."""
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename),stat.st_mtime_ns,stat.st_size,variant)
+        with self._lock:
+            if key in self.arrays:
+                self.arrays.move_to_end(key)
+                return self.arrays[key]
+        if self.path:
+            npy = os.path.join(self.path,hashlib.sha1(repr(key).encode('utf-8')).hexdigest()+'.npy')
+            if not os.path.exists(npy):
+                os.makedirs(self.path,exist_ok=True)
+                # written under a temporary name, so that other processes never see a partial file
+                with open(npy+'.part','wb') as file:
+                    np.save(file,decode(filename))
+                os.replace(npy+'.part',npy)
+            array = np.load(npy,mmap_mode='r')
+        else:
+            array = np.asarray(decode(filename))
+            array.setflags(write=False)
+        with self._lock:
+            self.arrays[key] = array
+            while len(self.arrays)>self.maxsize:
+                self.arrays.popitem(last=False) # forget the least recently used array
+        return array
+    
+    def clear(self):
+        """Forgets all arrays kept in memory. Files in `path` are kept."""
+        with self._lock:
+            self.arrays.clear()
+
+
+image_files = file_cache()
+
+def _read_image(filename):
+    """Reads an image file, and returns it as an array of floats from 0 to 1 with four channels (RGBA)."""
+    image = mpl_image.imread(filename)
+    if image.dtype==np.uint8:
+        image = image.astype(np.float32)/255
+    else:
+        image = image.astype(np.float32)
+    if image.ndim==2: # greyscale
+        image = np.stack([image]*3,axis=2)
+    if image.shape[2]==3:
+        image = np.concatenate([image,np.ones(image.shape[:2]+(1,),dtype=np.float32)],axis=2)
+    return image
+
+def _blend_images(filenames,weights,folder='images'):
+    """Returns the weighted average of the images with the given filenames (without the '.png'). Filenames that are None are skipped, and the remaining weights are normalized. All images should be the same size."""
+    blended = None
+    total = 0
+    for filename,weight in zip(filenames,weights):
+        if filename is not None and weight>0:
+            image = image_files.get(os.path.join(folder,filename+'.png'),_read_image)
+            if blended is None:
+                blended = weight*image
+            else:
+                blended += weight*image
+            total += weight
+    return blended/total
+
+@_instrument('image_superposer',after='plotting')
+def image_superposer (all_images,images,bias=0.5,device='qasm_simulator',noisy=False,shots=1024,figsize=(20,20),render='show'):
     """Creates superposition of two images from a set of images.
     
     A dictionary is returned, which supplies the relative strength of each pair of ascii characters in the superposition. An image representing the superposition, with each of the original images appearing with an weight that represents their strength in the superposition, is also created.
     
-    all_images = List of strings that are filenames for a set of images.  The files should be located in 'images/<filename>.png relative to where the code is executed.
-    images = List of strings for image files to be superposed. This can either contain the strings for two files, or for all in all_images. Other options are not currently supported.
+    all_images = List of strings that are filenames for a set of images, or a `filename_index` made from such a list (which is faster for large sets). The files should be located in 'images/<filename>.png relative to where the code is executed.
+    images = List of strings for image files to be superposed, or a list of such lists. For two files, the first appears with strength `bias`. Any other number of files from all_images are superposed equally.
     device = A string specifying a backend. The noisy behaviour from a real device will result in images other than those intended appearing with non-zero strength.
-    shots = Number of times the process is repeated to calculate the fractions used as strengths."""
+    shots = Number of times the process is repeated to calculate the fractions used as strengths.
+    render = How the image is created. It is always the weighted average of the images, calculated with NumPy from decoded images kept by `image_files` (so each file is only read once). For render='show' it is saved in 'outputs' and shown with pyplot. For render='file' it is only saved in 'outputs'. For render='array' or render='png', the output is a tuple of the dictionary and the image as an RGBA NumPy array or as PNG bytes (or lists of each). For render=None, no image is made at all."""
 
     image_stats_list = _filename_superposer (all_images,images,bias,device,noisy,shots)
-    print(image_stats_list)
-    
-    for image_stats in image_stats_list:  
-        # sort from least to most likely and create corresponding lists of the strings and fractions
-        sorted_strings = sorted(image_stats,key=image_stats.get)
-        sorted_fracs = sorted(image_stats.values())
-        n = len(image_stats)
-        # construct alpha values such that the final image is a weighted average of the images specified by the keys of `image_stats`
-        alpha = [ sorted_fracs[0] ]
-        for j in range(0,n-1):
-            alpha.append( ( alpha[j]/(1-alpha[j]) ) * ( sorted_fracs[j+1] / sorted_fracs[j] ) )
-
-        fig, ax = plt.subplots(figsize=figsize)
-        for j in reversed(range(n)):
-            filename = sorted_strings[j]
-            if filename:
-                image = plt.imread( "images/"+filename+".png" )
-                plt.imshow(image,alpha=alpha[j])
-        plt.axis('off')
-        plt.savefig('outputs/image_'+datetime.datetime.now().strftime("%H:%M:%S %p on %B %d, %Y")+'.png')
-        plt.show()
+    if render=='show':
+        print(image_stats_list)
+    
+    blended_list = []
+    for image_stats in image_stats_list:
+        if not render:
+            continue
+        blended = _blend_images(list(image_stats.keys()),list(image_stats.values()))
+        if render=='show':
+            fig, ax = plt.subplots(figsize=figsize)
+            plt.imshow(blended)
+            plt.axis('off')
+            plt.savefig(_output_file('image_'))
+            plt.show()
+        elif render=='file':
+            mpl_image.imsave(_output_file('image_'),blended)
+        elif render=='png':
+            buffer = io.BytesIO()
+            mpl_image.imsave(buffer,blended,format='png')
+            blended_list.append(buffer.getvalue())
+        else:
+            blended_list.append(blended)
     
     # if only one instance was given, output dict rather than list with a single dict
     if len(image_stats_list)==1:
         image_stats_list = image_stats_list[0]
+        blended_list = blended_list[0] if blended_list else None
     
-    return image_stats_list
+    if render in ['array','png']:
+        return image_stats_list, blended_list
+    else:
+        return image_stats_list
+
+audio_files = file_cache()
+
+def _pcm_to_float(data,sampwidth,channels):
+    """Converts PCM bytes, as stored in wav files, to an array of floats from -1 to 1 with a column for each channel."""
+    if sampwidth==1: # 8 bit samples are unsigned
+        array = ( np.frombuffer(data,dtype=np.uint8).astype(np.float32)-128 )/128
+    elif sampwidth==2:
+        array = np.frombuffer(data,dtype='<i2').astype(np.float32)/2**15
+    elif sampwidth==3: # 24 bit samples are padded to 32 bits
+        raw = np.frombuffer(data,dtype=np.uint8).reshape(-1,3)
+        padded = np.zeros((len(raw),4),dtype=np.uint8)
+        padded[:,1:] = raw
+        array = padded.view('<i4').reshape(-1).astype(np.float32)/2**31
+    else:
+        array = np.frombuffer(data,dtype='<i4').astype(np.float32)/2**31
+    return array.reshape(-1,channels)
+
+def _read_audio(filename):
+    """Decodes an audio file into an array of floats from -1 to 1, with a column for each channel. Wav files are read with the `wave` module, and other formats with pydub."""
+    try:
+        with wave.open(filename,'rb') as file:
+            return _pcm_to_float(file.readframes(file.getnframes()),file.getsampwidth(),file.getnchannels())
+    except wave.Error:
+        segment = pydub.AudioSegment.from_file(filename)
+        return _pcm_to_float(segment.raw_data,segment.sample_width,segment.channels)
 
-def audio_superposer (all_audio,audio,bias=0.5,device='qasm_simulator',noisy=False,shots=1024,format='wav'):
+def _float_to_pcm(array,sampwidth):
+    """Converts an array of floats from -1 to 1 into PCM bytes with the given sample width, as stored in wav files."""
+    array = np.clip(array,-1,1)
+    if sampwidth==1: # 8 bit samples are unsigned
+        return np.clip( np.round(array*128)+128, 0, 255 ).astype(np.uint8).tobytes()
+    elif sampwidth==2:
+        return np.round( array*(2**15-1) ).astype('<i2').tobytes()
+    elif sampwidth==3: # the top three bytes of 32 bit samples
+        return np.round( array.astype(np.float64)*(2**31-1) ).astype('<i4').view(np.uint8).reshape(-1,4)[:,1:].tobytes()
+    else:
+        return np.round( array.astype(np.float64)*(2**31-1) ).astype('<i4').tobytes()
+
+@functools.lru_cache(maxsize=1024)
+def _audio_params(filename,mtime):
+    """Returns the sample rate and sample width (in bytes) of an audio file. The modification time is given so that changed files are looked at again."""
+    try:
+        with wave.open(filename,'rb') as file:
+            return file.getframerate(), file.getsampwidth()
+    except wave.Error:
+        segment = pydub.AudioSegment.from_file(filename)
+        return segment.frame_rate, segment.sample_width
+
+def _resample(array,rate,new_rate):
+    """Converts audio, given as an array with a column for each channel, from one sample rate to another by linear interpolation."""
+    if rate==new_rate:
+        return array
+    times = np.arange( int(round(len(array)*new_rate/rate)) )*(rate/new_rate)
+    return np.stack([ np.interp(times,np.arange(len(array)),array[:,channel]) for channel in range(array.shape[1]) ],axis=1).astype(np.float32)
+
+def _audio_chunks(filename,chunk,stream=False,rate=None):
+    """Yields the decoded audio of a file, `chunk` frames at a time. For `stream=True`, wav files are read from disk as they are needed, rather than being decoded in full and kept by `audio_files`. If a sample `rate` is given that differs from that of the file, the audio is resampled to it (and is then always decoded in full and kept)."""
+    file_rate = _audio_params(filename,os.stat(filename).st_mtime_ns)[0]
+    if rate is None:
+        rate = file_rate
+    if stream and rate==file_rate:
+        try:
+            file = wave.open(filename,'rb')
+        except wave.Error:
+            file = None
+        if file is not None:
+            with file:
+                while True:
+                    data = file.readframes(chunk)
+                    if not data:
+                        return
+                    yield _pcm_to_float(data,file.getsampwidth(),file.getnchannels())
+    if rate==file_rate:
+        array = audio_files.get(filename,_read_audio)
+    else:
+        array = audio_files.get(filename,lambda filename: _resample(_read_audio(filename),file_rate,rate),variant=rate)
+    for start in range(0,len(array),chunk):
+        yield array[start:start+chunk]
+
+def _mix_audio(filenames,gains,output,format='wav',chunk=2**16,stream=False):
+    """Mixes the given audio files, with each multiplied by the corresponding amplitude gain, and writes the result to the file `output`. The first file sets the length, sample rate, sample width and number of channels of the mix. Files with other sample rates are resampled to match.
+    
+    The mix is made `chunk` frames at a time. For wav output, each chunk is written as soon as it is made, so that with `stream=True` (or memory-mapped arrays in `audio_files`) the memory used does not depend on the length of the files."""
+    rate, sampwidth = _audio_params(filenames[0],os.stat(filenames[0]).st_mtime_ns)
+    sources = [ _audio_chunks(filename,chunk,stream,rate) for filename in filenames ]
+    
+    writer = None
+    pieces = []
+    for base in sources[0]:
+        channels = base.shape[1]
+        mixed = gains[0]*base
+        for source,gain in zip(sources[1:],gains[1:]):
+            part = next(source,None)
+            if part is None: # this file is shorter than the first
+                continue
+            part = part[:len(mixed)]
+            if part.shape[1]!=channels: # mismatched channels are mixed down to mono first
+                part = part.mean(axis=1,keepdims=True)
+            mixed[:len(part)] += gain*part
+        pcm = _float_to_pcm(mixed,sampwidth)
+        if format=='wav':
+            if writer is None:
+                writer = wave.open(output,'wb')
+                writer.setnchannels(channels)
+                writer.setsampwidth(sampwidth)
+                writer.setframerate(rate)
+            writer.writeframes(pcm)
+        else:
+            pieces.append(pcm)
+    
+    if format=='wav':
+        if writer is not None:
+            writer.close()
+    else:
+        pydub.AudioSegment(data=b''.join(pieces),sample_width=sampwidth,frame_rate=rate,channels=channels).export(output,format=format)
+
+@_instrument('audio_superposer')
+def audio_superposer (all_audio,audio,bias=0.5,device='qasm_simulator',noisy=False,shots=1024,format='wav',chunk=2**16,stream=False):
+    """Creates superposition of two audio files from a set of audio files.
+    
+    A list of dictionaries is returned, which supply the relative strength of each file in the superposition. The files are also mixed, with the power of each proportional to its strength, and saved in 'outputs'. 
+    
+    all_audio = List of strings that are filenames for a set of audio files, or a `filename_index` made from such a list (which is faster for large sets). The files should be located in 'audio/<filename>.<format>' relative to where the code is executed.
+    audio = List of strings for audio files to be superposed, or a list of such lists. For two files, the first has strength `bias`. Any other number of files from all_audio are superposed equally.
+    device = A string specifying a backend. The noisy behaviour from a real device will result in files other than those intended appearing with non-zero strength.
+    shots = Number of times the process is repeated to calculate the fractions used as strengths.
+    format = Format of the audio files, and of the output. Wav files are decoded with the `wave` module, and others with pydub. Decoded files are kept by `audio_files`, so repeated superpositions of the same files are not decoded again.
+    chunk = Number of frames mixed at a time.
+    stream = Whether wav files are read from disk chunk by chunk during mixing, rather than decoded in full and kept. This keeps memory bounded for long files. Files whose sample rate differs from that of the loudest file are resampled to match it, and so are always decoded in full.
+    The mix has the sample rate, sample width and channels of the loudest file."""
     
     audio_stats_list = _filename_superposer (all_audio,audio,bias,device,noisy,shots)
     
-    for audio_stats in audio_stats_list:
+    if type(audio[0])==str:
+        audio_list = [audio]
+    else:
+        audio_list = audio
+    
+    for audio_stats,files in zip(audio_stats_list,audio_list):
         loudest = max(audio_stats, key=audio_stats.get)
-        mixed = AudioSegment.from_wav('audio/'+loudest+'.'+format)
-        for filename in audio_stats:
-            if filename != loudest:
-                dBFS = np.log10( audio_stats[filename]/audio_stats[loudest] )
-                file = AudioSegment.from_wav('audio/'+filename+'.'+format) - dBFS
-                mixed = mixed.overlay(file)
-        mixed.export('outputs/audio_'+'_'.join(audio)+'.'+format, format=format) 
+        # the loudest file is first, since it sets the properties of the mix
+        filenames = [ filename for filename in audio_stats if filename is not None and filename!=loudest and audio_stats[filename]>0 ]
+        filenames = [loudest] + filenames
+        # power is proportional to the strength, so the amplitude is proportional to its square root
+        gains = [ np.sqrt( audio_stats[filename]/audio_stats[loudest] ) for filename in filenames ]
+        os.makedirs('outputs',exist_ok=True)
+        output = 'outputs/audio_'+'_'.join(files)+'.'+format
+        _mix_audio([ 'audio/'+filename+'.'+format for filename in filenames ],gains,output,format,chunk,stream)
     
     return audio_stats_list
 
@@ -485,6 +1563,10 @@ class layout:
         pairs = Dictionary detailing the pairs of qubits for which cnot gates can be directly implemented. Each value is a list of two qubits for which this is possible. The corresponding key is a string that is used as the name of the pair.
         pos = A dictionary of positions for qubits, to be used in plots.
         """
+        self._totals = None # totals used by `calculate_probs()` when accumulating results
+        self._G = None # graph and artists used by `plot()`
+        self._artists = {}
+        
         if device in ['ibmq_5_yorktown', 'ibmq_16_melbourne']:          
             backend = get_backend(device)
             self.num = backend.configuration().n_qubits
@@ -531,29 +1613,54 @@ class layout:
         for pair in self.pairs:
             self.pos[pair] = [(self.pos[self.pairs[pair][0]][j] + self.pos[self.pairs[pair][1]][j])/2 for j in range(2)]
   
-    def calculate_probs(self,raw_stats):
-        """Given a counts dictionary as the input `raw_stats`, a dictionary of probabilities is returned. The keys for these are either integers (referring to qubits) or strings (referring to pairs of neighbouring qubits). For the qubit entries, the corresponding value is the probability that the qubit is in state `1`. For the pair entries, the values are the probabilities that the two qubits disagree (so either the outcome `01` or `10`."""
-        Z = 0
-        for string in raw_stats:
-            Z += raw_stats[string]
-        stats = {}
-        for string in raw_stats:
-            stats[string] = raw_stats[string]/Z
+    @_instrument('layout.calculate_probs')
+    def calculate_probs(self,raw_stats,accumulate=False):
+        """Given a counts dictionary as the input `raw_stats`, a dictionary of probabilities is returned. The keys for these are either integers (referring to qubits) or strings (referring to pairs of neighbouring qubits). For the qubit entries, the corresponding value is the probability that the qubit is in state `1`. For the pair entries, the values are the probabilities that the two qubits disagree (so either the outcome `01` or `10`.
+        
+        A list of output strings (such as from the memory of a job) can also be supplied as `raw_stats`, with each string counting as a single shot.
+        
+        accumulate = If True, the results are added to those from all previous calls with `accumulate=True`, and the probabilities for them all are returned. This allows large numbers of results to be processed in chunks. Use `reset_probs()` to start again."""
+        if type(raw_stats) is dict:
+            strings = list(raw_stats.keys())
+            weights = np.array(list(raw_stats.values()),dtype=float)
+        else:
+            strings = list(raw_stats)
+            weights = np.ones(len(strings))
+        
+        pairs = list(self.pairs.keys())
+        first = [ self.pairs[pair][0] for pair in pairs ]
+        second = [ self.pairs[pair][1] for pair in pairs ]
+        
+        if strings:
+            # convert the strings to an array with a column for each qubit, for which qubit n is given by character -n-1
+            length = len(strings[0])
+            bits = np.frombuffer( ''.join(strings).encode('ascii'), dtype=np.uint8 ).reshape(len(strings),length) - ord('0')
+            bits = bits[:, length-1-np.arange(self.num)]
+            totals = [ np.sum(weights), weights @ bits, weights @ (bits[:,first]!=bits[:,second]) ]
+        else: # nothing to add (such as for an empty chunk)
+            totals = [ 0.0, np.zeros(self.num), np.zeros(len(pairs)) ]
+        if accumulate:
+            if self._totals:
+                totals = [ total+old_total for total,old_total in zip(totals,self._totals) ]
+            self._totals = totals
+        (Z, ones, disagreements) = totals
         
         probs = {}
         for n in self.pos:
             probs[n] = 0
-        
-        for string in stats:
+        if Z: # without any shots, all probabilities are left as zero
             for n in range(self.num):
-                if string[-n-1]=='1':
-                    probs[n] += stats[string]
-            for pair in self.pairs: 
-                if string[-self.pairs[pair][0]-1]!=string[-self.pairs[pair][1]-1]:
-                    probs[pair] += stats[string]
+                probs[n] = ones[n]/Z
+            for j,pair in enumerate(pairs):
+                probs[pair] = disagreements[j]/Z
             
         return probs
+    
+    def reset_probs(self):
+        """Forgets the results added by previous calls of `calculate_probs()` with `accumulate=True`."""
+        self._totals = None
                     
+    @_instrument('layout.plot',after='plotting')
     def plot(self,probs={},labels={},colors={},sizes={}):
         """An image representing the device is created and displayed.
         
@@ -561,19 +1668,78 @@ class layout:
         
         The kwargs should all be supplied in the form of dictionaries for which qubit numbers and pair labels are the keys (i.e., the same keys as for the `pos` attribute).
         
-        If `probs` is supplied (such as from the output of the `calculate_probs()` method, the labels, colors and sizes of qubits and pairs will be determined by these probabilities. Otherwise, the other kwargs set these properties directly."""                
-        G=nx.Graph()
+        If `probs` is supplied (such as from the output of the `calculate_probs()` method, the labels, colors and sizes of qubits and pairs will be determined by these probabilities. Otherwise, the other kwargs set these properties directly.
         
-        for pair in self.pairs:
-            G.add_edge(self.pairs[pair][0],self.pairs[pair][1])
-            G.add_edge(self.pairs[pair][0],pair)
-            G.add_edge(self.pairs[pair][1],pair)
+        To change the properties of an existing plot, `update_plot()` is much faster."""                
+        G = self._graph()
+        labels, colors, sizes = self._plot_properties(probs,labels,colors,sizes)
+
+        # convert to lists, which is required by nx
+        color_list = []
+        size_list = []
+        for node in G:
+            color_list.append(colors[node])
+            size_list.append(sizes[node])
+        
+        area = [0,0]
+        for coord in self.pos.values():
+            for j in range(2):
+                area[j] = max(area[j],coord[j])
+        for j in range(2):
+            area[j] = (area[j] + 1 )*1.1
+            
+        if area[0]>2*area[1]:
+            ratio = 0.65
+        else:
+            ratio = 1
+
+        self._fig = plt.figure(2,figsize=(2*area[0],2*ratio*area[1]))
+        self._fig.clf()
+        ax = self._fig.gca()
+        # the artists are kept, so that `update_plot()` can change them
+        self._artists = {}
+        self._artists['nodes'] = nx.draw_networkx_nodes(G, self.pos, node_color = color_list, node_size = size_list, ax=ax)
+        self._artists['edges'] = nx.draw_networkx_edges(G, self.pos, ax=ax)
+        self._artists['labels'] = nx.draw_networkx_labels(G, self.pos, labels = labels, font_color ='w', font_size = 18, ax=ax)
+        ax.set_axis_off()
+        plt.show()
+        
+    @_instrument('layout.update_plot',after='plotting')
+    def update_plot(self,probs={},labels={},colors={},sizes={}):
+        """Changes the labels, colors and sizes of the qubits and pairs in the image created by `plot()`, without drawing it again from scratch. The kwargs are the same as for `plot()`. If there is no image yet, `plot()` is used to create one."""
+        if not self._artists:
+            self.plot(probs=probs,labels=labels,colors=colors,sizes=sizes)
+            return
+        
+        labels, colors, sizes = self._plot_properties(probs,labels,colors,sizes)
+        nodes = list(self._graph())
+        self._artists['nodes'].set_facecolor( [colors[node] for node in nodes] )
+        self._artists['nodes'].set_sizes( [sizes[node] for node in nodes] )
+        for node in self._artists['labels']:
+            if node in labels:
+                self._artists['labels'][node].set_text( str(labels[node]) )
+        self._fig.canvas.draw_idle()
+        self._fig.canvas.flush_events()
+        
+    def _graph(self):
+        # returns the graph of qubits and pairs used for plots, which is made only once
+        if self._G is None:
+            self._G = nx.Graph()
+            for pair in self.pairs:
+                self._G.add_edge(self.pairs[pair][0],self.pairs[pair][1])
+                self._G.add_edge(self.pairs[pair][0],pair)
+                self._G.add_edge(self.pairs[pair][1],pair)
+        return self._G
+    
+    def _plot_properties(self,probs,labels,colors,sizes):
+        # determines the labels, colors and sizes for every node of the graph, as described in `plot()`
+        G = self._graph()
         
         if probs:
             
-            label_changes = copy.deepcopy(labels)
-            color_changes = copy.deepcopy(colors)
-            size_changes = copy.deepcopy(sizes)
+            label_changes = dict(labels)
+            color_changes = dict(colors)
+            size_changes = dict(sizes)
             
             labels = {}
             colors = {}
@@ -624,46 +1790,90 @@ class layout:
                     else:
                         sizes[node] = 750
 
-        # convert to lists, which is required by nx
-        color_list = []
-        size_list = []
-        for node in G:
-            color_list.append(colors[node])
-            size_list.append(sizes[node])
+        return labels, colors, sizes
         
-        area = [0,0]
-        for coord in self.pos.values():
-            for j in range(2):
-                area[j] = max(area[j],coord[j])
-        for j in range(2):
-            area[j] = (area[j] + 1 )*1.1
-            
-        if area[0]>2*area[1]:
-            ratio = 0.65
-        else:
-            ratio = 1
-
-        plt.figure(2,figsize=(2*area[0],2*ratio*area[1])) 
-        nx.draw(G, self.pos, node_color = color_list, node_size = size_list, labels = labels, with_labels = True,
-                font_color ='w', font_size = 18)
-        plt.show()
         
+_pauli_matrix = {'I':np.array([[1,0],[0,1]]), 'X':np.array([[0,1],[1,0]]), 'Y':np.array([[0,-1j],[1j,0]]), 'Z':np.array([[1,0],[0,-1]])}
+        
+# two qubit gates are applied as the `cx` and single qubit gates they are unrolled into, since noise is added to these
+# each entry is (name, qubits, factor), where the angle of the gate is multiplied by factor (if there is one)
+_two_qubit_decompositions = {'cx':[('cx',[0,1],None)],
+                             'cz':[('h',[1],None),('cx',[0,1],None),('h',[1],None)],
+                             'swap':[('cx',[0,1],None),('cx',[1,0],None),('cx',[0,1],None)],
+                             'crz':[('u1',[1],0.5),('cx',[0,1],None),('u1',[1],-0.5),('cx',[0,1],None)]}
+
+def _depolarize(rho,qubit,p):
+    # applies a depolarizing error with probability `p` to the given qubit of a two qubit density matrix
+    mixed = sum( _embed(_pauli_matrix[P],qubit) @ rho @ _embed(_pauli_matrix[P],qubit) for P in 'XYZ' )
+    return (1-3*p/4)*rho + p/4*mixed
+
+def _embed(matrix,qubit):
+    # the single qubit matrix acting on one of two qubits (qubit 0 is the least significant)
+    return np.kron(np.eye(2),matrix) if qubit==0 else np.kron(matrix,np.eye(2))
+
+def _noisy_rho(qc,noisy):
+    """Returns the two qubit density matrix created by the gates of `qc` with the simple noise model of `get_noise()`. As for the jobs it describes (whose gates are unrolled into u1, u2, u3 and cx, see `_run_batch()`), a depolarizing error follows each single qubit gate (except `id`), and each `cx` is followed by independent depolarizing errors on both qubits. Other two qubit gates are applied as the `cx` and single qubit gates they are unrolled into. Gates not supported by `_gate_matrix()` raise a ValueError."""
+    p_gate1 = _noise_params(noisy)[1]
+    rho = np.zeros((4,4),dtype=complex)
+    rho[0,0] = 1
+    for gate in qc.data:
+        if gate.name in ['barrier','snapshot']:
+            continue
+        qubits = [ qarg[1] for qarg in gate.qargs ]
+        params = [ float(param) for param in gate.param ]
+        angle = params if len(params)>1 else (params[0] if params else None)
+        if len(qubits)==1 and gate.name not in ['measure','reset']:
+            matrix = _gate_matrix(gate.name,angle)
+            if matrix is not None:
+                U = _embed(matrix,qubits[0])
+                rho = U @ rho @ U.conj().T
+                if gate.name!='id':
+                    rho = _depolarize(rho,qubits[0],p_gate1)
+                continue
+        elif gate.name in _two_qubit_decompositions:
+            for (name,positions,factor) in _two_qubit_decompositions[gate.name]:
+                targets = [ qubits[j] for j in positions ]
+                if name=='cx':
+                    # the matrix of `_gate_matrix` has the control as the most significant qubit
+                    U = _gate_matrix('cx')
+                    if targets[0]==0:
+                        swap = _gate_matrix('swap')
+                        U = swap @ U @ swap
+                else:
+                    U = _embed(_gate_matrix(name,None if factor is None else factor*angle),targets[0])
+                rho = U @ rho @ U.conj().T
+                for qubit in targets:
+                    rho = _depolarize(rho,qubit,p_gate1)
+            continue
+        raise ValueError("The gate '"+gate.name+"' cannot be used with device='exact' and noise. Use a simulator instead.")
+    return rho
+
+
 class pauli_grid():
     # Allows a quantum circuit to be created, modified and implemented, and visualizes the output in the style of 'Hello Quantum'.
 
-    def __init__(self,device='qasm_simulator',noisy=False,shots=1024,mode='circle',y_boxes=False):
+    def __init__(self,device='qasm_simulator',noisy=False,shots=1024,mode='circle',y_boxes=False,blit=False):
         """
         device='qasm_simulator'
-            Backend to be used by Qiskit to calculate expectation values (defaults to local simulator).
+            Backend to be used by Qiskit to calculate expectation values (defaults to local simulator). For device='exact', the expectation values are calculated directly from the statevector, without sampling noise.
+        noisy=False
+            Noise model, as used by `get_noise()`. For device='exact', the simple noise model of `get_noise()` is applied to a density matrix, gate by gate (see `_noisy_rho()`).
         shots=1024
             Number of shots used to to calculate expectation values.
         mode='circle'
             Either the standard 'Hello Quantum' visualization can be used (with mode='circle') or the alternative line based one (mode='line').
         y_boxes=True
             Whether to display full grid that includes Y expectation values.
+        blit=False
+            Whether `update_grid()` redraws only the circles, lines and text (on top of a cached background), rather than the whole figure. This is much faster for animations, but requires an interactive backend that supports blitting.
         """
         
-        self.backend = get_backend(device)
+        self.exact = (device=='exact')
+        if self.exact:
+            self.backend = get_backend('statevector_simulator')
+        else:
+            self.backend = get_backend(device)
+        self.noisy = noisy
         self.noise_model = get_noise(noisy)
         self.shots = shots
         
@@ -702,39 +1912,72 @@ class pauli_grid():
             w = plt.plot( [self.box[pauli][0],self.box[pauli][0]], [self.box[pauli][1],self.box[pauli][1]], color=(1.0,1.0,1.0), lw=0 )
             b = plt.plot( [self.box[pauli][0],self.box[pauli][0]], [self.box[pauli][1],self.box[pauli][1]], color=(0.0,0.0,0.0), lw=0 )
             c = {}
-            c['w'] = self.ax.add_patch( Circle(self.box[pauli], 0.0, color=(0,0,0), zorder=10) )
-            c['b'] = self.ax.add_patch( Circle(self.box[pauli], 0.0, color=(1,1,1), zorder=10) )
+            c['w'] = self.ax.add_patch( patches.Circle(self.box[pauli], 0.0, color=(0,0,0), zorder=10) )
+            c['b'] = self.ax.add_patch( patches.Circle(self.box[pauli], 0.0, color=(1,1,1), zorder=10) )
             self.lines[pauli] = {'w':w,'b':b,'c':c}
+            
+        # the boxes, circles and labels are created by the first call to `update_grid()`, and then only updated
+        self._drawn = False
+        self._props = {} # the properties last set for each artist, so that unchanged ones are left alone
+        self._changed = True
+        
+        self.blit = blit
+        self._background = None
+        if self.blit:
+            self.fig.canvas.mpl_connect('draw_event',self._on_draw)
                          
     
+    @_instrument('pauli_grid.get_rho')
     def get_rho(self):
         # Runs the circuit specified by self.qc and determines the expectation values for 'ZI', 'IZ', 'ZZ', 'XI', 'IX', 'XX', 'ZX' and 'XZ' (and the ones with Ys too if needed).
         
+        if self.exact:
+            self._get_exact_rho()
+            return
+        
+        batch = self._rho_circuits()
+        self._set_rho( batch, _execute(batch,self.backend,self.noise_model,self.shots) )
+        
+    async def get_rho_async(self):
+        """Awaitable version of `get_rho()`. When `scheduler` is enabled, the circuits are run in the same job as those of other callers."""
+        if self.exact:
+            self._get_exact_rho()
+            return
+        batch = self._rho_circuits()
+        self._set_rho( batch, await _execute_async(batch,self.backend,self.noise_model,self.shots) )
+    
+    def _bases(self):
+        # the two qubit bases that are measured, and the single qubit Paulis they give
         if self.y_boxes:
             corr = ['ZZ','ZX','XZ','XX','YY','YX','YZ','XY','ZY']
             ps = ['X','Y','Z']
         else:
             corr = ['ZZ','ZX','XZ','XX']
             ps = ['X','Z']
-        
-        results = {}
+        return corr, ps
+    
+    def _rho_circuits(self):
+        # returns a copy of self.qc with the measurements added for each basis, so that all are measured in a single job
+        corr, ps = self._bases()
+        batch = []
         for basis in corr:
             temp_qc = copy.deepcopy(self.qc)
             for j in range(2):
-                if basis[j]=='X':
-                    temp_qc.h(self.qr[j])
-                elif basis[j]=='Y':
-                    temp_qc.sdg(self.qr[j])
-                    temp_qc.h(self.qr[j])
+                _twobit_measure(temp_qc,self.qr[j],basis[j])
             temp_qc.barrier(self.qr)
             temp_qc.measure(self.qr,self.cr)
-            try:
-                job = execute(temp_qc, backend=self.backend, noise_model=self.noise_model, shots=self.shots)
-            except:
-                job = execute(temp_qc, backend=self.backend, shots=self.shots)
-            results[basis] = job.result().get_counts()
-            for string in results[basis]:
-                results[basis][string] = results[basis][string]/self.shots
+            batch.append(temp_qc)
+        return batch
+    
+    def _set_rho(self,batch,result):
+        # determines the expectation values from the result of running the circuits from `_rho_circuits()`
+        corr, ps = self._bases()
+        results = {}
+        for basis,temp_qc in zip(corr,batch):
+            stats = result.get_counts(temp_qc)
+            results[basis] = {}
+            for string in stats:
+                results[basis][string] = stats[string]/self.shots
 
         prob = {}
         # prob of expectation value -1 for single qubit observables
@@ -760,7 +2003,29 @@ class pauli_grid():
 
         for pauli in prob:
             self.rho[pauli] = 1-2*prob[pauli]
+            
+    def _get_exact_rho(self):
+        # Determines the expectation values from the statevector for self.qc (or, with noise, the density matrix), rather than by sampling.
+        
+        if self.noisy:
+            if type(self.noisy) is str:
+                raise ValueError("Noise models from real devices cannot be used with device='exact'. Use noisy=True or a float instead.")
+            rho = _noisy_rho(self.qc,self.noisy)
+            p_meas, p_gate1 = _noise_params(self.noisy)
+        else:
+            psi = np.asarray( _execute(self.qc,self.backend).get_statevector() )
+            rho = np.outer(psi,psi.conj())
+            p_meas, p_gate1 = 0, 0
+        for pauli in self.box:
+            # qubit 0 is the least significant in the statevector, so its Pauli goes on the right
+            op = np.kron( _pauli_matrix[pauli[1]], _pauli_matrix[pauli[0]] )
+            expect = np.real( np.trace(op @ rho) )
+            # each qubit measured then has the depolarizing errors of the gates that change its basis, and a bit flip
+            for P in pauli.replace('I',''):
+                expect *= (1-p_gate1)**_twobit_measure_gates['XYZ'.index(P)] * (1-2*p_meas)
+            self.rho[pauli] = expect
     
+    @_instrument('pauli_grid.update_grid',after='plotting')
     def update_grid(self,rho=None,labels=False,bloch=None,hidden=[],qubit=True,corr=True,message=""):
         """
         rho = None
@@ -826,36 +2091,31 @@ class pauli_grid():
                     c = ( self.box[pauli_pos][0]-l/(2*np.sqrt(2)), self.box[pauli_pos][1]-l/(2*np.sqrt(2)) )
                     b = ( (1-p)*a[0] + p*c[0] , (1-p)*a[1] + p*c[1] )
                     lw = 9
-                self.lines[pauli]['w'].pop(0).remove()
-                self.lines[pauli]['b'].pop(0).remove()
-                self.lines[pauli]['w'] = plt.plot( [a[0],b[0]], [a[1],b[1]], color=(1.0,1.0,1.0), lw=lw )
-                self.lines[pauli]['b'] = plt.plot( [b[0],c[0]], [b[1],c[1]], color=(0.0,0.0,0.0), lw=lw )
+                self._update( self.lines[pauli]['w'][0], xdata=[a[0],b[0]], ydata=[a[1],b[1]], linewidth=lw )
+                self._update( self.lines[pauli]['b'][0], xdata=[b[0],c[0]], ydata=[b[1],c[1]], linewidth=lw )
                 return coord
         
         l = 0.9 # line length
         r = 0.6 # circle radius
         L = 0.98*np.sqrt(2) # box height and width
         
-        if rho==None:
+        if rho is None:
             self.get_rho()
+        else:
+            self.rho.update(rho)
+            
+        if not self._drawn:
+            self._draw_static(r,L)
 
-        # draw boxes
-        for pauli in self.box:
-            if 'I' in pauli:
-                color = self.colors[1]
-            else:
-                color = self.colors[2]
-            self.ax.add_patch( Rectangle( (self.box[pauli][0],self.box[pauli][1]-1), L, L, angle=45, color=color) )  
-
-        # draw circles
+        # update circles
         for pauli in self.box:
             unhidden = see_if_unhidden(pauli)
-            if unhidden:
-                if self.mode=='line':
-                    self.ax.add_patch( Circle(self.box[pauli], r, color=(0.5,0.5,0.5)) )
-                else:
-                    prob = (1-self.rho[pauli])/2
-                    self.ax.add_patch( Circle(self.box[pauli], r, color=(prob,prob,prob)) )
+            if self.mode=='line':
+                color = (0.5,0.5,0.5)
+            else:
+                prob = (1-self.rho[pauli])/2
+                color = (prob,prob,prob)
+            self._update( self.lines[pauli]['circle'], visible=unhidden, color=color )
 
         # update bars if required
         if self.mode=='line':
@@ -866,8 +2126,7 @@ class pauli_grid():
                     z_coord = add_line('Z',pz,pz)
                     x_coord = add_line('X',pz,px)
                     for j in self.lines[pz]['c']:
-                        self.lines[pz]['c'][j].center = (x_coord,z_coord)
-                        self.lines[pz]['c'][j].radius = (j=='w')*0.05 + (j=='b')*0.04
+                        self._update( self.lines[pz]['c'][j], center=(x_coord,z_coord), radius=(j=='w')*0.05 + (j=='b')*0.04 )
                 px = 'I'*(bloch=='0') + 'X' + 'I'*(bloch=='1')
                 pz = 'I'*(bloch=='0') + 'Z' + 'I'*(bloch=='1')
                 add_line('Z',pz,pz)
@@ -875,7 +2134,7 @@ class pauli_grid():
             else:
                 for pauli in self.box:
                     for j in self.lines[pauli]['c']:
-                        self.lines[pauli]['c'][j].radius = 0.0
+                        self._update( self.lines[pauli]['c'][j], radius=0.0 )
                     if pauli in ['ZI','IZ','ZZ']:
                         add_line('Z',pauli,pauli)
                     if pauli in ['XI','IX','XX']: 
@@ -883,11 +2142,26 @@ class pauli_grid():
                     if pauli in ['XZ','ZX']:
                         add_line('ZX',pauli,pauli)
              
-        self.bottom.set_text(message)
+        self._update( self.bottom, text=message )
         
-        if labels:
-            for pauli in self.box:
-                plt.text(self.box[pauli][0]-0.18,self.box[pauli][1]-0.85, pauli)
+        for pauli in self.box:
+            self._update( self.lines[pauli]['label'], visible=labels )
+        
+        self._render()
+        
+    def _draw_static(self,r,L):
+        # Draws the boxes, which never change, and creates the circles and labels that are then updated by `update_grid()`.
+        
+        for pauli in self.box:
+            if 'I' in pauli:
+                color = self.colors[1]
+            else:
+                color = self.colors[2]
+            self.ax.add_patch( patches.Rectangle( (self.box[pauli][0],self.box[pauli][1]-1), L, L, angle=45, color=color) )  
+        
+        for pauli in self.box:
+            self.lines[pauli]['circle'] = self.ax.add_patch( patches.Circle(self.box[pauli], r, color=(0.5,0.5,0.5), visible=False) )
+            self.lines[pauli]['label'] = self.ax.text(self.box[pauli][0]-0.18,self.box[pauli][1]-0.85, pauli, visible=False)
         
         if self.y_boxes:
             self.ax.set_xlim([-4,4])
@@ -895,27 +2169,99 @@ class pauli_grid():
         else:
             self.ax.set_xlim([-3,3])
             self.ax.set_ylim([0,6])
+            
+        # when blitting, everything except the boxes is drawn on top of the cached background
+        if self.blit:
+            for artist in self._animated():
+                artist.set_animated(True)
+            
+        self._drawn = True
+        self._changed = True
         
-        self.fig.canvas.draw()
+    def _animated(self):
+        # Returns all artists that are changed by `update_grid()`, in the order they should be drawn.
+        artists = [self.bottom]
+        for pauli in self.box:
+            artists += [ self.lines[pauli]['circle'], self.lines[pauli]['label'], self.lines[pauli]['w'][0], self.lines[pauli]['b'][0] ]
+            artists += list(self.lines[pauli]['c'].values())
+        return sorted(artists,key=lambda artist: artist.get_zorder())
+    
+    def _update(self,artist,**props):
+        # Sets the given properties of the artist, but only if they differ from those set last time.
+        old_props = self._props.setdefault(artist,{})
+        for prop in props:
+            if prop not in old_props or old_props[prop]!=props[prop]:
+                old_props[prop] = props[prop]
+                if hasattr(artist,'set_'+prop):
+                    getattr(artist,'set_'+prop)(props[prop])
+                else:
+                    setattr(artist,prop,props[prop])
+                self._changed = True
+                
+    def _on_draw(self,event):
+        # After a full redraw, store the background for blitting and then draw the animated artists on top.
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self._animated():
+            self.fig.draw_artist(artist)
+            
+    def _render(self):
+        # Shows the changes made by `update_grid()`, if there are any.
+        if not self._changed:
+            return
+        if self.blit and self._background is not None:
+            self.fig.canvas.restore_region(self._background)
+            for artist in self._animated():
+                self.fig.draw_artist(artist)
+            self.fig.canvas.blit(self.fig.bbox)
+            self.fig.canvas.flush_events()
+        else:
+            self.fig.canvas.draw() # when blitting, this also stores the background via `_on_draw()`
+        self._changed = False
         
         
+def _bits_to_ints(bits):
+    """Converts a 2D NumPy array of bits into a 1D array of the integers that each row represents, with the most significant bit first. For rows of more than 63 bits, the array contains Python ints."""
+    precision = bits.shape[1]
+    if precision<=63:
+        return bits.astype(np.int64) @ (2**np.arange(precision-1,-1,-1,dtype=np.int64))
+    else:
+        # pad each row at the front to a whole number of bytes, so that it can be converted via bytes
+        pad = (-precision)%8
+        padded = np.concatenate( (np.zeros((bits.shape[0],pad),dtype=np.uint8),bits), axis=1 )
+        ints = np.empty(bits.shape[0],dtype=object)
+        for j,row in enumerate(np.packbits(padded,axis=1)):
+            ints[j] = int.from_bytes(row.tobytes(),'big')
+        return ints
+
 class qrng ():
-    """This object generations `num` strings, each of `precision=8192/num` bits. These are then dispensed one-by-one as random integers, floats, etc, depending on the method called. Once all `num` strings are used, it'll loop back around."""
-    def __init__( self, precision=None, num = 1280, sim=True, noisy=False, noise_only=False, verbose=True ):
+    """This object generations `num` strings, each of `precision` bits, from the results of `jobs` jobs of 8192 shots on 5 qubits. These are then dispensed one-by-one as random integers, floats, etc, depending on the method called. Once all `num` strings are used, it'll loop back around."""
+    @_instrument('qrng')
+    def __init__( self, precision=None, num=None, sim=True, noisy=False, noise_only=False, verbose=True, jobs=None ):
+        """If only one of `precision` and `num` is given, the other is chosen such that the bits from `jobs` jobs (one by default) are used. If both are given, enough jobs are run to supply `num*precision` bits. If neither are given, `num=1280`."""
         
-        if precision:
+        bits_per_job = 5*8192
+        if precision and num:
             self.precision = precision
-            self.num = int(np.floor( 5*8192/self.precision ))
-        else:
             self.num = num
-            self.precision = int(np.floor( 5*8192/self.num ))
-        
-        q = QuantumRegister(5)
-        c = ClassicalRegister(5)
-        qc = QuantumCircuit(q,c)
-        if not noise_only:
-            qc.h(q)
-        qc.measure(q,c)
+            jobs = int(np.ceil( self.num*self.precision/bits_per_job ))
+        else:
+            jobs = jobs or 1
+            if precision:
+                self.precision = precision
+                self.num = int(np.floor( jobs*bits_per_job/self.precision ))
+            else:
+                self.num = num or 1280
+                self.precision = int(np.floor( jobs*bits_per_job/self.num ))
+        
+        batch = []
+        for j in range(jobs):
+            q = QuantumRegister(5)
+            c = ClassicalRegister(5)
+            qc = QuantumCircuit(q,c,name='qrng_'+str(j))
+            if not noise_only:
+                qc.h(q)
+            qc.measure(q,c)
+            batch.append(qc)
         
         if sim:
             backend = get_backend('qasm_simulator')
@@ -924,38 +2270,34 @@ class qrng ():
         
         if verbose and not sim:
             print('Sending job to quantum device')
-        try:
-            job = execute(qc,backend,shots=8192,noise_model=get_noise(noisy),memory=True)
-        except:
-            job = execute(qc,backend,shots=8192,memory=True)
-        data = job.result().get_memory()
+        result = _execute(batch,backend,get_noise(noisy),shots=8192,memory=True,cache=False) # random numbers must never be reused
+        data = []
+        for qc in batch:
+            data += result.get_memory(qc)
         if verbose and not sim:
             print('Results from device received')
         
-        full_data = []
-        for datum in data:
-            full_data += list(datum)
-        
-        self.int_list = []
-        self.bit_list = []
-        n = 0
-        for _ in range(num):
-            bitstring = ''
-            for b in range(self.precision):
-                bitstring += full_data[n]
-                n += 1
-            self.bit_list.append(bitstring)
-            self.int_list.append( int(bitstring,2) )
+        # all results are joined into a single array of bits, which is kept in packed form as `pool`
+        full_data = np.frombuffer( ''.join(data).encode('ascii'), dtype=np.uint8 ) - ord('0')
+        self.pool_bits = self.num*self.precision
+        self.pool = np.packbits( full_data[:self.pool_bits] )
+        self.pool.flags.writeable = False # since `read()` hands out views of it
+        self.int_list = _bits_to_ints( full_data[:self.pool_bits].reshape(self.num,self.precision) )
             
         self.n = 0
+        
+    @property
+    def bit_list(self):
+        # the random strings as bit strings, which are made only when asked for
+        return [ format(int(int_value),'0'+str(self.precision)+'b') for int_value in self.int_list ]
     
     def _iterate(self):
         
-        self.n = self.n+1 % self.num
+        self.n = (self.n+1) % self.num
     
     def rand_int(self):
         # get a random integer
-        rand_int = self.int_list[self.n]
+        rand_int = int(self.int_list[self.n])
         
         self._iterate()
         
@@ -963,11 +2305,41 @@ class qrng ():
     
     def rand(self):
         # get a random float
-        rand_float = self.int_list[self.n] / 2**self.precision
+        rand_float = int(self.int_list[self.n]) / 2**self.precision
         
         self._iterate()
         
         return rand_float
+    
+    def rand_ints(self,n):
+        """Returns a NumPy array of the next `n` random integers."""
+        indices = (self.n + np.arange(n)) % self.num
+        self.n = (self.n+n) % self.num
+        return self.int_list[indices]
+    
+    def rands(self,n):
+        """Returns a NumPy array of the next `n` random floats."""
+        return self.rand_ints(n).astype(float) / 2**self.precision
+    
+    def read(self,nbytes):
+        """Returns the next `nbytes` random bytes as a read-only memoryview. When these start at a byte boundary in the pool and don't need to loop back around, they are a view of the pool rather than a copy. The cursor moves on by as many random integers as are needed to supply the bits."""
+        start = self.n*self.precision
+        self.n = (self.n + int(np.ceil(8*nbytes/self.precision))) % self.num
+        if start%8==0 and start+8*nbytes<=self.pool_bits:
+            return memoryview(self.pool)[start//8:start//8+nbytes]
+        else:
+            # only the bytes of the pool that cover the bits needed are unpacked, in a piece for each time it loops around
+            pieces = []
+            needed = 8*nbytes
+            while needed:
+                take = min(needed,self.pool_bits-start)
+                offset = start%8
+                pieces.append( np.unpackbits( self.pool[start//8:(start+take+7)//8] )[offset:offset+take] )
+                needed -= take
+                start = 0
+            chunk = np.packbits( np.concatenate(pieces) )
+            chunk.flags.writeable = False
+            return memoryview(chunk)
 
     
 class random_grid ():
@@ -981,12 +2353,14 @@ class random_grid ():
             self.qr = QuantumRegister(Lx*Ly)
             self.cr = ClassicalRegister(Lx*Ly)
             self.qc = QuantumCircuit(self.qr,self.cr)
+            self.gates = [] # gates applied by `NOT` and `CNOT`, which are used for device='mps'
+            self._index_cache = None # the `coord_map` used by `_index()`, and the index made with it
             
         def address(self,x,y):
             # returns the index for the qubit associated with grid point (x,y)
             # 
             if self.coord_map:
-                address = coord_map( (x,y) )
+                address = self.coord_map( (x,y) )
             else:
                 address = y*self.Lx + x
             return address
@@ -1000,45 +2374,137 @@ class random_grid ():
                     neighbours.append( (xx,yy) )
             return neighbours
                 
-        def get_samples(self,device='qasm_simulator',noisy=False,shots=1024):
-            # run the program and get samples
-            def separate_string(string):
-                string = string[::-1]
-                grid = []
-                for y in range(self.Ly):
-                    line = ''
-                    for x in range(self.Lx):
-                        line += string[self.address(x,y)]
-                    grid.append(line)
-                return '\n'.join(grid)
-            
+        def _index(self):
+            # returns an Ly by Lx array of the qubit indices for the grid points, so that all results can be decoded at once
+            # this is made only once, and then again only if `coord_map` is changed
+            if self._index_cache is None or self._index_cache[0] is not self.coord_map:
+                if self.coord_map:
+                    index = np.zeros((self.Ly,self.Lx),dtype=int)
+                    for y in range(self.Ly):
+                        for x in range(self.Lx):
+                            index[y,x] = self.address(x,y)
+                else:
+                    index = np.arange(self.Lx*self.Ly).reshape(self.Ly,self.Lx)
+                index.flags.writeable = False
+                self._index_cache = (self.coord_map,index)
+            return self._index_cache[1]
+        
+        def _decode(self,strings):
+            # converts a list of output strings into a (len(strings),Ly,Lx) array of bits
+            num = self.Lx*self.Ly
+            bits = np.frombuffer( ''.join(strings).encode('ascii'), dtype=np.uint8 ).reshape(len(strings),num) - ord('0')
+            # output strings have the bit for qubit 0 on the right
+            return bits[:, num-1-self._index()]
+        
+        def _grid_strings(self,grids):
+            # converts a (k,Ly,Lx) array of bits into k strings, with a line for each row of the grid
+            chars = np.full( (len(grids),self.Ly,self.Lx+1), ord('\n'), dtype=np.uint8 )
+            chars[:,:,:self.Lx] = grids + ord('0')
+            text = chars.tobytes().decode('ascii')
+            size = self.Ly*(self.Lx+1)
+            return [ text[j*size:(j+1)*size-1] for j in range(len(grids)) ] # the final newline of each is dropped
+        
+        def _circuit(self):
+            # returns a copy of the program with the measurements added
             temp_qc = copy.deepcopy(self.qc)
             temp_qc.barrier(self.qr)
             temp_qc.measure(self.qr,self.cr)
+            return temp_qc
+        
+        def _run(self,device,noisy,shots):
+            # run the program and return the result
+            return _execute(self._circuit(),get_backend(device),get_noise(noisy),shots,memory=True)
+        
+        def _mps_samples(self,noisy,shots,bond_dim):
+            # simulates the gates in `self.gates` with a matrix product state, and returns a (shots,Ly,Lx) array of sampled bits
+            state = _mps(self.Lx*self.Ly,bond_dim)
+            for (name,angle,coords) in self.gates:
+                qubits = [ self.address(x,y) for (x,y) in coords ]
+                if len(qubits)==1:
+                    state.apply(_gate_matrix(name,angle),qubits[0])
+                else:
+                    state.apply_pair(_gate_matrix(name,angle),qubits[0],qubits[1])
+            bits = _flip_bits( state.sample(shots), noisy )
+            return bits[:,self._index()]
+        
+        def _tiled_samples(self,device,noisy,shots,bond_dim,tile,overlap,processes):
+            # splits the grid into tiles, samples each in a separate process, and stitches the results together
+            tasks = []
+            regions = []
+            for y0 in range(0,self.Ly,tile[1]):
+                for x0 in range(0,self.Lx,tile[0]):
+                    # the core of the tile, whose samples are used, and the tile with overlap, which is simulated
+                    core = (x0, y0, min(x0+tile[0],self.Lx), min(y0+tile[1],self.Ly))
+                    ext = (max(x0-overlap,0), max(y0-overlap,0), min(core[2]+overlap,self.Lx), min(core[3]+overlap,self.Ly))
+                    gates = []
+                    for (name,angle,coords) in self.gates:
+                        if all( ext[0]<=x<ext[2] and ext[1]<=y<ext[3] for (x,y) in coords ):
+                            gates.append( (name,angle,[ (x-ext[0],y-ext[1]) for (x,y) in coords ]) )
+                    # each tile gets its own seed, since processes may start with copies of the same random state
+                    tasks.append( (ext[2]-ext[0],ext[3]-ext[1],gates,device,noisy,shots,bond_dim,np.random.randint(2**31)) )
+                    regions.append( (core,ext) )
             
-            # different backends require different executions, and this block somehow works
-            try: 
-                job = execute(temp_qc,backend=get_backend(device),noise_model=get_noise(noisy),shots=shots,memory=True)
-            except:
-                try:
-                    if device=='ibmq_qasm_simulator':
-                        raise
-                    backend=get_backend(device)
-                    qobj = compile(temp_qc,backend,pass_manager=PassManager())
-                    job = backend.run(qobj)
-                except:
-                    job = execute(temp_qc,backend=get_backend(device),shots=shots,memory=True)
+            if processes==1:
+                tile_samples = list(map(_sample_tile,tasks))
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                    tile_samples = list(pool.map(_sample_tile,tasks))
+            
+            grids = np.zeros((shots,self.Ly,self.Lx),dtype=np.uint8)
+            for (core,ext),samples in zip(regions,tile_samples):
+                grids[:,core[1]:core[3],core[0]:core[2]] = samples[:, core[1]-ext[1]:core[3]-ext[1], core[0]-ext[0]:core[2]-ext[0]]
+            return grids
+        
+        @_instrument('random_grid.get_array')
+        def get_array(self,device='qasm_simulator',noisy=False,shots=1024,bond_dim=16,tile=None,overlap=1,processes=None):
+            """Runs the program, and returns the samples as a (shots,Ly,Lx) NumPy array of bits, such that the element [s,y,x] is the value for grid point (x,y) in sample s. This is much faster than `get_samples()` for large grids or numbers of shots.
+            
+            For device='mps', no job is run. Instead the gates applied by `NOT` and `CNOT` are simulated with a matrix product state, whose bonds are truncated to at most `bond_dim`. This allows grids with thousands of points to be simulated, with memory proportional to the number of points. Gates added to `self.qc` directly are ignored, and noise is applied as independent bit flips (as for `bitstring_superposer` with device='exact').
+            
+            When `tile=(tx,ty)` is given, the grid is instead split into tiles of tx by ty points, which are simulated independently in a pool of `processes` processes (all cores by default, or no pool for `processes=1`). Each tile is simulated along with a border of `overlap` points from its neighbours, using the gates applied by `NOT` and `CNOT` that lie entirely within this region. Only the samples for points within the tile itself are kept, so every point of the stitched grid comes from exactly one tile, and points near a seam still feel the gates on the other side of it."""
+            if tile:
+                return self._tiled_samples(device,noisy,shots,bond_dim,tile,overlap,processes)
+            if device=='mps':
+                return self._mps_samples(noisy,shots,bond_dim)
+            result = self._run(device,noisy,shots)
+            try: # real memory
+                data = result.get_memory()
+            except: # fake memory from stats
+                stats = result.get_counts()
+                data = []
+                for string in stats:
+                    data += [string]*stats[string]
+            return self._decode(data)
                 
-            stats = job.result().get_counts()
+        @_instrument('random_grid.get_samples')
+        def get_samples(self,device='qasm_simulator',noisy=False,shots=1024,bond_dim=16,tile=None,overlap=1,processes=None):
+            """Runs the program, and returns the samples as strings with a line for each row of the grid. These are given both as a dictionary of counts for each string (`grid_stats`) and a list of the string for each sample (`grid_data`). See `get_array()` for an alternative that returns a NumPy array, and for details of device='mps' and the tiling kwargs."""
+            if device=='mps' or tile:
+                grid_data = self._grid_strings( self.get_array(device,noisy,shots,bond_dim,tile,overlap,processes) )
+                grid_stats = dict( collections.Counter(grid_data) )
+                return grid_stats, grid_data
+            
+            return self._samples(self._run(device,noisy,shots))
+        
+        async def get_samples_async(self,device='qasm_simulator',noisy=False,shots=1024,bond_dim=16,tile=None,overlap=1,processes=None):
+            """Awaitable version of `get_samples()`, with the same kwargs. When `scheduler` is enabled, the circuit is run in the same job as those of other callers. For device='mps' or tiling, no job is run and the samples are made directly."""
+            if device=='mps' or tile:
+                return self.get_samples(device,noisy,shots,bond_dim,tile,overlap,processes)
+            result = await _execute_async(self._circuit(),get_backend(device),get_noise(noisy),shots,memory=True)
+            return self._samples(result)
+        
+        def _samples(self,result):
+            # converts the result of running the program into the output of `get_samples()`
+            stats = result.get_counts()
+            strings = list(stats.keys())
+            grid_strings = dict( zip( strings, self._grid_strings(self._decode(strings)) ) )
             grid_stats = {}
             for string in stats:
-                grid_stats[separate_string(string)] = stats[string]
+                grid_stats[grid_strings[string]] = stats[string]
                 
             try: # real memory
-                data = job.result().get_memory()
-                grid_data = []
-                for string in data:
-                    grid_data.append(separate_string(string))
+                data = result.get_memory()
+                grid_data = [ grid_strings[string] for string in data ]
             except: # fake memory from stats
                 grid_data = []
                 for string in grid_stats:
@@ -1046,24 +2512,185 @@ class random_grid ():
             
             return grid_stats, grid_data
         
+        def _gate(self,name,coords,angle=None):
+            # applies the named gate to the qubits for the given list of coords, and records it in `self.gates`
+            qubits = [ self.qr[self.address(x,y)] for (x,y) in coords ]
+            if angle is None:
+                getattr(self.qc,name)(*qubits)
+            else:
+                getattr(self.qc,name)(angle,*qubits)
+            self.gates.append( (name,angle,coords) )
+        
         def NOT (self,coords,frac=1,axis='x'):
             '''Implement an rx or ry on the qubit for the given coords, according to the given fraction (`frac=1` is a NOT gate) and the given axis ('x' or 'y').'''
             if axis=='x':
-                self.qc.rx(np.pi*frac,self.qr[self.address(coords[0],coords[1])])
+                self._gate('rx',[coords],np.pi*frac)
             else:
-                self.qc.ry(np.pi*frac,self.qr[self.address(coords[0],coords[1])])
+                self._gate('ry',[coords],np.pi*frac)
             
         def CNOT (self,ctl,tgt,frac=1,axis='x'):
             '''Controlled version of the `NOT` above'''
             if axis=='y':
-                self.qc.sdg(self.qr[self.address(tgt[0],tgt[1])])
-            self.qc.h(self.qr[self.address(tgt[0],tgt[1])])
-            self.qc.crz(np.pi*frac,self.qr[self.address(ctl[0],ctl[1])],self.qr[self.address(tgt[0],tgt[1])])
-            self.qc.h(self.qr[self.address(tgt[0],tgt[1])])
+                self._gate('sdg',[tgt])
+            self._gate('h',[tgt])
+            self._gate('crz',[ctl,tgt],np.pi*frac)
+            self._gate('h',[tgt])
             if axis=='y':
-                self.qc.s(self.qr[self.address(tgt[0],tgt[1])])
+                self._gate('s',[tgt])
+
+
+def _sample_tile(task):
+    """Samples a single tile for `random_grid._tiled_samples()`. This is a separate function so that it can be run in another process."""
+    (Lx,Ly,gates,device,noisy,shots,bond_dim,seed) = task
+    np.random.seed(seed)
+    grid = random_grid(Lx,Ly)
+    for (name,angle,coords) in gates:
+        grid._gate(name,coords,angle)
+    return grid.get_array(device=device,noisy=noisy,shots=shots,bond_dim=bond_dim)
+
+def _gate_matrix(name,angle=None):
+    """Returns the unitary for the named gate as a NumPy array. For two qubit gates, the first qubit is the control. For `u2` and `u3`, `angle` is the list of their parameters."""
+    if name=='id':
+        return np.eye(2)
+    elif name=='h':
+        return np.array([[1,1],[1,-1]])/np.sqrt(2)
+    elif name=='s':
+        return np.array([[1,0],[0,1j]])
+    elif name=='sdg':
+        return np.array([[1,0],[0,-1j]])
+    elif name=='t':
+        return np.array([[1,0],[0,np.exp(0.25j*np.pi)]])
+    elif name=='tdg':
+        return np.array([[1,0],[0,np.exp(-0.25j*np.pi)]])
+    elif name in ['x','y','z']:
+        return _pauli_matrix[name.upper()]
+    elif name=='rx':
+        return np.array([[np.cos(angle/2),-1j*np.sin(angle/2)],[-1j*np.sin(angle/2),np.cos(angle/2)]])
+    elif name=='ry':
+        return np.array([[np.cos(angle/2),-np.sin(angle/2)],[np.sin(angle/2),np.cos(angle/2)]])
+    elif name=='rz':
+        return np.diag([np.exp(-0.5j*angle),np.exp(0.5j*angle)])
+    elif name=='u1':
+        return np.diag([1,np.exp(1j*angle)])
+    elif name=='u2':
+        return _gate_matrix('u3',[np.pi/2]+list(angle))
+    elif name=='u3':
+        theta, phi, lam = angle
+        return np.array([[np.cos(theta/2),-np.exp(1j*lam)*np.sin(theta/2)],
+                         [np.exp(1j*phi)*np.sin(theta/2),np.exp(1j*(phi+lam))*np.cos(theta/2)]])
+    elif name=='cx':
+        return np.array([[1,0,0,0],[0,1,0,0],[0,0,0,1],[0,0,1,0]])
+    elif name=='crz':
+        return np.diag([1,1,np.exp(-0.5j*angle),np.exp(0.5j*angle)])
+    elif name=='swap':
+        return np.array([[1,0,0,0],[0,0,1,0],[0,1,0,0],[0,0,0,1]])
+    
+class _mps():
+    """A matrix product state for `num` qubits, used to simulate circuits too large for a statevector. The qubits are placed along a line, and gates between distant qubits are applied by swapping them next to each other. Memory is proportional to `num*bond_dim**2`."""
+    
+    def __init__(self,num,bond_dim=None):
+        """num = Number of qubits, which are all initialized in state 0.
+        bond_dim = Maximum bond dimension. Bonds larger than this are truncated, keeping the largest singular values. For `bond_dim=None` there is no truncation, which is exact but can use exponential memory."""
+        self.num = num
+        self.bond_dim = bond_dim
+        # each tensor has indices (left bond, qubit, right bond)
+        self.tensors = [ np.array([1,0],dtype=complex).reshape(1,2,1) for _ in range(num) ]
+        self.center = 0 # all tensors to the left of this are left-canonical, and all to the right are right-canonical
+        
+    def _move_center(self,j):
+        # moves the orthogonality center to site j using QR decompositions
+        while self.center<j:
+            c = self.center
+            l,_,r = self.tensors[c].shape
+            Q,R = np.linalg.qr( self.tensors[c].reshape(l*2,r) )
+            self.tensors[c] = Q.reshape(l,2,-1)
+            self.tensors[c+1] = np.einsum('km,msr->ksr',R,self.tensors[c+1])
+            self.center += 1
+        while self.center>j:
+            c = self.center
+            l,_,r = self.tensors[c].shape
+            Q,R = np.linalg.qr( self.tensors[c].reshape(l,2*r).T )
+            self.tensors[c] = Q.T.reshape(-1,2,r)
+            self.tensors[c-1] = np.einsum('lsm,km->lsk',self.tensors[c-1],R)
+            self.center -= 1
+            
+    def apply(self,gate,j):
+        """Applies the single qubit unitary `gate` to qubit j."""
+        self.tensors[j] = np.einsum('st,ltr->lsr',gate,self.tensors[j])
+        
+    def _apply_neighbours(self,gate,j,left=False):
+        # applies the two qubit unitary `gate` to qubits j and j+1, and leaves the orthogonality center on j+1 (or j for left=True)
+        self._move_center(j)
+        l = self.tensors[j].shape[0]
+        r = self.tensors[j+1].shape[2]
+        theta = np.einsum('lsm,mtr->lstr',self.tensors[j],self.tensors[j+1])
+        theta = np.einsum('abst,lstr->labr',gate.reshape(2,2,2,2),theta)
+        U,S,V = np.linalg.svd( theta.reshape(l*2,2*r), full_matrices=False )
+        keep = max(1,np.sum( S>1e-12*S[0] ))
+        if self.bond_dim:
+            keep = min(keep,self.bond_dim)
+        U,S,V = U[:,:keep], S[:keep]/np.linalg.norm(S[:keep]), V[:keep,:]
+        if left:
+            self.tensors[j] = (U*S).reshape(l,2,keep)
+            self.tensors[j+1] = V.reshape(keep,2,r)
+            self.center = j
+        else:
+            self.tensors[j] = U.reshape(l,2,keep)
+            self.tensors[j+1] = (S[:,None]*V).reshape(keep,2,r)
+            self.center = j+1
+            
+    def apply_pair(self,gate,j,k):
+        """Applies the two qubit unitary `gate` to qubits j and k (which act as its first and second qubit, respectively). If these are not neighbours, qubit k is swapped next to j and then back again."""
+        if j>k:
+            swap = _gate_matrix('swap')
+            gate = swap @ gate @ swap
+            j,k = k,j
+        for m in range(k-1,j,-1):
+            self._apply_neighbours(_gate_matrix('swap'),m,left=True)
+        self._apply_neighbours(gate,j)
+        for m in range(j+1,k):
+            self._apply_neighbours(_gate_matrix('swap'),m)
+            
+    def sample(self,shots):
+        """Returns a (shots,num) NumPy array of bits sampled from measuring all qubits, with column j for qubit j."""
+        self._move_center(0) # so that the marginal probabilities can be calculated from left to right
+        bits = np.zeros((shots,self.num),dtype=np.uint8)
+        env = np.ones((shots,1),dtype=complex) # contraction of the tensors to the left with the bits sampled so far
+        for j in range(self.num):
+            amps = np.einsum('nl,lsr->nsr',env,self.tensors[j])
+            probs = np.sum(np.abs(amps)**2,axis=2)
+            bits[:,j] = np.random.random(shots) < probs[:,1]/np.sum(probs,axis=1)
+            chosen = amps[np.arange(shots),bits[:,j],:]
+            env = chosen / np.sqrt(probs[np.arange(shots),bits[:,j]])[:,None]
+        return bits
 
                 
+_bit_strings_cache = {}
+_square_layout_cache = {}
+
+def _bit_strings(n):
+    """Returns a list of all n-bit strings, such that element j is the string for the integer j."""
+    if n not in _bit_strings_cache:
+        _bit_strings_cache[n] = [ format(j,'0'+str(n)+'b') for j in range(2**n) ]
+    return _bit_strings_cache[n]
+
+def _square_layout(n):
+    """Returns a 2D NumPy array of the integers for the n-bit strings placed at each position by the 'square' method of `random_mountain.get_mountain()`. Element [y,x] is for position (x,y). The x and y coordinates are each converted to Gray code, and the bits of these are interleaved (with x for the even bits and y for the odd ones), so that neighbouring positions differ by only one bit."""
+    if n not in _square_layout_cache:
+        Lx = int(2**np.ceil(n/2))
+        Ly = int(2**np.floor(n/2))
+        x_gray = np.arange(Lx) ^ (np.arange(Lx)>>1)
+        y_gray = np.arange(Ly) ^ (np.arange(Ly)>>1)
+        layout = np.zeros((Ly,Lx),dtype=np.int64)
+        for j in range(n):
+            if (j%2)==0:
+                layout |= ( (x_gray>>(j//2))%2 << j )[None,:]
+            else:
+                layout |= ( (y_gray>>(j//2))%2 << j )[:,None]
+        layout.flags.writeable = False
+        _square_layout_cache[n] = layout
+    return _square_layout_cache[n]
+
 class random_mountain():
     '''Create a random set of (x,y,z) coordinates that look something like a mountain'''
     def __init__(self,n):
@@ -1073,67 +2700,77 @@ class random_mountain():
         self.cr = ClassicalRegister(n)
         self.qc = QuantumCircuit(self.qr,self.cr)
         
+    @property
+    def prob(self):
+        # the probabilities as a dictionary keyed by bit strings, which is made only when asked for
+        return dict( zip( _bit_strings(self.n), self.probs.tolist() ) )
+    
+    def _get_probs(self,device,noisy,shots):
+        # returns a NumPy array of the probabilities for all n-bit strings, indexed by the integer each string represents
+        if device=='exact':
+            # probabilities come straight from the statevector, in which the index is also the integer for the output string
+            temp_qc = copy.deepcopy(self.qc)
+            psi = np.asarray( _execute(temp_qc,get_backend('statevector_simulator')).get_statevector() )
+            probs = np.abs(psi)**2
+            if noisy: # each bit is flipped independently with the probability given by the noise model
+                flip = _exact_prob(0,noisy)
+                probs = probs.reshape([2]*self.n)
+                for axis in range(self.n):
+                    probs = (1-flip)*probs + flip*np.flip(probs,axis=axis)
+                probs = probs.reshape(-1)
+        else:
+            temp_qc = copy.deepcopy(self.qc)
+            temp_qc.measure(self.qr,self.cr)
+            stats = _execute(temp_qc,get_backend(device),get_noise(noisy),shots).get_counts()
+            probs = np.zeros(2**self.n)
+            probs[ [int(string,2) for string in stats] ] = np.array(list(stats.values()))/shots
+        return probs
+        
+    @_instrument('random_mountain.get_mountain')
     def get_mountain(self,new_data=True,method='square',device='qasm_simulator',noisy=False,shots=None):
-        # run based on the current circuit performed on self.qc
+        """Runs the current circuit performed on self.qc, and returns a dictionary of (x,y) positions for each n-bit string, and a dictionary of heights for each string.
+        
+        device = A string specifying a backend. For device='exact', the probabilities are read directly from the statevector, and so the cost depends on 2**n rather than on the number of shots. The simple noise model of `get_noise()` is then approximated by independent bit flips, with the error of a single gate and a measurement for each bit.
+        shots = Number of shots used to estimate the probabilities. If not given, 4**n are used. For device='exact', this only sets the minimum height of 1/shots."""
         if shots==None:
             shots = 2**(2*self.n)
         if new_data:
-            temp_qc = copy.deepcopy(self.qc)
-            temp_qc.measure(self.qr,self.cr)
-            job = execute(temp_qc, backend=get_backend(device),noise_model=get_noise(noisy),shots=shots)
-            stats = job.result().get_counts()
-
-            self.prob = {}
-            for string in ['0'*(self.n-len(bin(j)[2:])) + bin(j)[2:] for j in range(2**self.n)]: # loop over all n-bit strings
-                try:
-                    self.prob[string] = stats[string]/shots
-                except:
-                    self.prob[string] = 0
-           
-        nodes = sorted(self.prob, key=self.prob.get)[::-1]
-        Z = {}
-        for node in nodes:
-            Z[node] = max(self.prob[node],1/shots)
+            self.probs = self._get_probs(device,noisy,shots)
+        
+        strings = _bit_strings(self.n)
+        heights = np.maximum(self.probs,1/shots)
+        nodes = np.argsort(self.probs,kind='stable')[::-1] # integers for the strings, from most to least likely
+        Z = dict( zip( [strings[node] for node in nodes], heights[nodes].tolist() ) )
                     
         if method=='rings': 
-            pos = {}
-            for node in nodes:
-                distance = 0
-                for j in range(self.n):
-                    distance += (node[j]!=nodes[0][j])/self.n
-                theta = random.random()*2*np.pi
-                pos[node] = (distance*np.cos(theta),distance*np.sin(theta))
-        else:
-        
-            Lx = int(2**np.ceil(self.n/2))
-            Ly = int(2**np.floor(self.n/2))
-            
-            strings = [ ['' for k in range(Lx)] for j in range(Ly)]
-            for y in range(Ly):
-                for x in range(Lx):
-                    for j in range(self.n):
-                        if (j%2)==0:
-                            xx = np.floor(x/2**(j/2))
-                            strings[y][x] = str( int( ( xx + np.floor(xx/2) )%2 ) ) + strings[y][x]
-                        else:
-                            yy = np.floor(y/2**((j-1)/2))
-                            strings[y][x] = str( int( ( yy + np.floor(yy/2) )%2 ) ) + strings[y][x]
-        
-            center = strings[int(np.floor(Ly/2))][int(np.floor(Lx/2))]
-            maxstring = nodes[0]
-            diff = ''
+            # distance from the center is the fraction of bits that differ from the most likely string
+            distance = np.zeros(len(nodes))
             for j in range(self.n):
-                diff += '0'*(center[j]==maxstring[j]) + '1'*(center[j]!=maxstring[j])
-            for y in range(Ly):
-                for x in range(Lx):
-                    newstring = ''
-                    for j in range(self.n):
-                        newstring += strings[y][x][j]*(diff[j]=='0') + ('0'*(strings[y][x][j]=='1')+'1'*(strings[y][x][j]=='0'))*(diff[j]=='1')
-                    strings[y][x] = newstring
-            
-            pos = {}
-            for y in range(Ly):
-                for x in range(Lx):
-                    pos[strings[y][x]] = (x,y)
+                distance += ((nodes^nodes[0])>>j)%2/self.n
+            theta = np.random.random(len(nodes))*2*np.pi
+            pos = dict( zip( [strings[node] for node in nodes], zip( (distance*np.cos(theta)).tolist(), (distance*np.sin(theta)).tolist() ) ) )
+        else:
+            layout = self._centered_layout(nodes[0])
+            self.heights = heights[layout]
+            (Ly,Lx) = layout.shape
+            xs, ys = np.meshgrid(np.arange(Lx),np.arange(Ly))
+            pos = dict( zip( [strings[node] for node in layout.ravel()], zip(xs.ravel().tolist(),ys.ravel().tolist()) ) )
    
-        return pos,Z
\ No newline at end of file
+        return pos,Z
+    
+    def _centered_layout(self,node):
+        # returns the layout of the 'square' method, with bits flipped such that the given string is at the center
+        layout = _square_layout(self.n)
+        (Ly,Lx) = layout.shape
+        return layout ^ ( layout[Ly//2,Lx//2] ^ node )
+    
+    @_instrument('random_mountain.get_height_map')
+    def get_height_map(self,new_data=True,device='qasm_simulator',noisy=False,shots=None):
+        """Returns the heights from the 'square' method of `get_mountain()` as a 2D NumPy array, such that element [y,x] is the height at position (x,y). This avoids making the dictionaries returned by `get_mountain()`, and so is much faster for large n. For details of kwargs, see `get_mountain()`."""
+        if shots==None:
+            shots = 2**(2*self.n)
+        if new_data:
+            self.probs = self._get_probs(device,noisy,shots)
+        most_likely = len(self.probs)-1-np.argmax(self.probs[::-1]) # the last, if there are many
+        self.heights = np.maximum(self.probs,1/shots)[ self._centered_layout(most_likely) ]
+        return self.heights
@@ -0,0 +1,57 @@
+# coding: utf-8
+
+# Measures the cold-start cost of `import CreativeQiskit`.
+#
+# Each repeat runs in a fresh interpreter, so nothing is already cached in `sys.modules`.
+# The heavy optional libraries should not be loaded by the import alone.
+#
+#     python benchmarks/import_time.py --repeats 5
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+here = os.path.abspath(os.path.dirname(__file__))
+root = os.path.dirname(here)
+
+HEAVY = ['matplotlib.pyplot','networkx','pydub','qiskit.providers.aer.noise']
+
+SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import CreativeQiskit
+end = time.perf_counter()
+heavy = {heavy}
+print(json.dumps({{'seconds':end-start,'loaded':[name for name in heavy if name in sys.modules]}}))
+'''
+
+def cold_import(python=sys.executable):
+    """Imports CreativeQiskit in a new interpreter, and returns the time taken along with which heavy modules were loaded."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH','')
+    output = subprocess.run([python,'-c',SCRIPT.format(heavy=HEAVY)],env=env,stdout=subprocess.PIPE,check=True).stdout
+    # anything printed during the import (such as account messages) comes before the json line
+    lines = output.decode().strip().split('\n')
+    report = json.loads(lines[-1])
+    report['printed'] = lines[:-1]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the cold-start cost of importing CreativeQiskit.')
+    parser.add_argument('--repeats',type=int,default=5)
+    args = parser.parse_args()
+
+    reports = [cold_import() for _ in range(args.repeats)]
+    times = sorted(report['seconds'] for report in reports)
+
+    print('import CreativeQiskit, %d cold starts'%args.repeats)
+    print('    min    = %.3f s'%times[0])
+    print('    median = %.3f s'%times[len(times)//2])
+    print('    max    = %.3f s'%times[-1])
+    print('    heavy modules loaded: %s'%(reports[0]['loaded'] or 'none'))
+    print('    output during import: %s'%(reports[0]['printed'] or 'none'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# coding: utf-8
+
+# Measures how many frames per second `pauli_grid.update_grid()` can draw.
+#
+# Expectation values are supplied directly, so only the rendering is timed.
+# The Agg backend is used by default, so that this can run without a display.
+#
+#     python benchmarks/pauli_grid_fps.py --frames 200
+
+import argparse
+import os
+import sys
+import time
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0,os.path.dirname(here))
+
+def fps(mode='circle',blit=False,y_boxes=False,frames=200,seed=0):
+    """Returns the number of frames per second for a sequence of random expectation values."""
+    import numpy as np
+    import CreativeQiskit
+
+    np.random.seed(seed)
+    grid = CreativeQiskit.pauli_grid(mode=mode,y_boxes=y_boxes,blit=blit)
+    grid.update_grid(rho=grid.rho) # first frame draws everything, so leave it out of the timing
+    rhos = []
+    for _ in range(frames):
+        rho = {}
+        for pauli in grid.box:
+            rho[pauli] = np.random.uniform(-1,1)
+        rhos.append(rho)
+
+    start = time.perf_counter()
+    for rho in rhos:
+        grid.update_grid(rho=rho)
+    return frames/(time.perf_counter()-start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the frame rate of pauli_grid.update_grid.')
+    parser.add_argument('--frames',type=int,default=200)
+    parser.add_argument('--backend',default='Agg',help='matplotlib backend to draw with')
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use(args.backend)
+
+    print('pauli_grid.update_grid, %d frames on %s'%(args.frames,args.backend))
+    for mode in ['circle','line']:
+        for y_boxes in [False,True]:
+            for blit in [False,True]:
+                print('    mode=%-6s y_boxes=%-5s blit=%-5s  %7.1f fps'%(mode,y_boxes,blit,fps(mode,blit,y_boxes,args.frames)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# coding: utf-8
+
+# Runs every public entry point of CreativeQiskit over a sweep of sizes, and reports the time and peak memory of each phase.
+#
+# Everything runs locally on the Aer simulator (or with device='exact'), with fixed seeds, so that the numbers
+# from different releases can be compared. Results can be saved as json, and compared against a saved file.
+#
+#     python benchmarks/run_benchmarks.py --quick
+#     python benchmarks/run_benchmarks.py --json new.json --compare old.json
+#     python benchmarks/run_benchmarks.py --only ladder random_grid --device exact
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0,os.path.dirname(here))
+
+
+class phases():
+    """Records the time and peak memory of each named phase of a benchmark, using `with phase('name'):`."""
+
+    def __init__(self,memory=True):
+        self.memory = memory
+        self.records = []
+
+    @contextlib.contextmanager
+    def __call__(self,name):
+        if self.memory:
+            if hasattr(tracemalloc,'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.clear_traces()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter()-start
+        peak = tracemalloc.get_traced_memory()[1]-start_memory if self.memory else None
+        self.records.append( (name,seconds,peak) )
+
+
+# Each benchmark takes the `phase` recorder, the size from its sweep, the device and the number of shots.
+# The sweeps are given as (full,quick) pairs in `BENCHMARKS` below.
+
+def ladder(phase,d,device,shots):
+    import CreativeQiskit
+    with phase('build'):
+        l = CreativeQiskit.ladder(d)
+        for _ in range(3*d):
+            l.add(1)
+    with phase('value'):
+        l.value(device=device,shots=shots)
+
+def ladder_array(phase,num,device,shots):
+    import CreativeQiskit
+    with phase('build'):
+        l = CreativeQiskit.ladder_array(num,10)
+        l.add(range(num))
+    with phase('value'):
+        l.value(device=device,shots=shots)
+
+def twobit(phase,shots,device,_):
+    import CreativeQiskit
+    with phase('build'):
+        b = CreativeQiskit.twobit()
+        b.prepare({'Z':True})
+    with phase('value'):
+        for basis in 'XZ'*5:
+            b.value(basis,device=device,shots=shots)
+
+def twobit_array(phase,num,device,shots):
+    import CreativeQiskit
+    with phase('build'):
+        b = CreativeQiskit.twobit_array(num)
+        b.prepare(['Z']*num,[True]*num)
+    with phase('value'):
+        b.value(['X']*num,device=device,shots=shots)
+
+def bell_correlation(phase,shots,device,_):
+    import CreativeQiskit
+    if device=='exact':
+        device = 'qasm_simulator' # no exact mode for this one
+    with phase('run'):
+        for basis in ['XX','XZ','ZX','ZZ']:
+            CreativeQiskit.bell_correlation(basis,device=device,shots=shots)
+
+def bitstring_superposer(phase,size,device,shots):
+    import CreativeQiskit
+    length, batch = size
+    with phase('run'):
+        strings = [ ['0'*length,bin(j)[2:].zfill(length)[-length:]] for j in range(1,batch+1) ]
+        CreativeQiskit.bitstring_superposer(strings,device=device,shots=shots)
+
+def emoticon_superposer(phase,batch,device,shots):
+    import CreativeQiskit
+    with phase('run'):
+        CreativeQiskit.emoticon_superposer([[';)','8)']]*batch,device=device,shots=shots)
+
+def filename_superposer(phase,num,device,shots):
+    from CreativeQiskit.CreativeQiskit import _filename_superposer # private, so not exported by the package
+    all_files = [ 'file'+str(j) for j in range(num) ]
+    with phase('run'):
+        _filename_superposer(all_files,['file0','file'+str(num-1)],0.5,device,False,shots)
+
+def layout_calculate_probs(phase,size,device,shots):
+    import numpy as np
+    import CreativeQiskit
+    L = size
+    grid = CreativeQiskit.layout([L,L])
+    with phase('data'):
+        raw_stats = [ ''.join(row) for row in np.random.choice(['0','1'],(shots,grid.num)) ]
+    with phase('calculate_probs'):
+        grid.calculate_probs(raw_stats)
+
+def pauli_grid(phase,shots,device,_):
+    import CreativeQiskit
+    with phase('build'):
+        grid = CreativeQiskit.pauli_grid(device=device,shots=shots)
+        grid.qc.h(grid.qr[0])
+        grid.qc.cx(grid.qr[0],grid.qr[1])
+    with phase('get_rho'):
+        grid.get_rho()
+    with phase('update_grid'):
+        for _ in range(10):
+            grid.update_grid()
+
+def qrng(phase,jobs,device,_):
+    import CreativeQiskit
+    with phase('run'):
+        q = CreativeQiskit.qrng(precision=32,jobs=jobs,verbose=False)
+    with phase('dispense'):
+        q.rand_ints(q.num)
+        q.rands(q.num)
+
+def random_grid(phase,size,device,shots):
+    import numpy as np
+    import CreativeQiskit
+    Lx, Ly = size
+    if Lx*Ly>20 and device!='mps':
+        device = 'mps' # too many qubits for the Aer simulator
+    with phase('build'):
+        grid = CreativeQiskit.random_grid(Lx,Ly)
+        for x in range(Lx):
+            for y in range(Ly):
+                grid.NOT((x,y),frac=np.random.random())
+        for x in range(Lx-1):
+            for y in range(Ly):
+                grid.CNOT((x,y),(x+1,y),frac=0.5)
+    with phase('get_samples'):
+        grid.get_samples(device='qasm_simulator' if device=='exact' else device,shots=shots)
+
+def random_mountain(phase,n,device,shots):
+    import numpy as np
+    import CreativeQiskit
+    with phase('build'):
+        mountain = CreativeQiskit.random_mountain(n)
+        for j in range(n):
+            mountain.qc.ry(np.pi*np.random.random(),mountain.qr[j])
+        for j in range(n-1):
+            mountain.qc.cx(mountain.qr[j],mountain.qr[j+1])
+    with phase('get_mountain'):
+        mountain.get_mountain(device=device,shots=shots)
+
+
+BENCHMARKS = [
+    (ladder, [5,50,500], [5]),
+    (ladder_array, [1,16,128], [4]),
+    (twobit, [1,1024,8192], [1024]),
+    (twobit_array, [1,16,128], [4]),
+    (bell_correlation, [1,1024,8192], [1024]),
+    (bitstring_superposer, [(4,1),(16,1),(8,16)], [(4,1)]),
+    (emoticon_superposer, [1,4], [1]),
+    (filename_superposer, [4,16,64], [4]),
+    (layout_calculate_probs, [2,4,5], [2]),
+    (pauli_grid, [1024,8192], [1024]),
+    (qrng, [1,4], [1]),
+    (random_grid, [(2,2),(4,4),(4,5),(16,16)], [(2,2)]),
+    (random_mountain, [4,8,12], [4]),
+]
+
+def run(benchmark,size,device='qasm_simulator',shots=1024,seed=0,memory=True):
+    """Runs a single benchmark for the given size, and returns a list of (phase,seconds,peak bytes)."""
+    import CreativeQiskit
+    CreativeQiskit.set_seed(seed)
+    phase = phases(memory)
+    benchmark(phase,size,device,shots)
+    return phase.records
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures time and peak memory for each entry point of CreativeQiskit.')
+    parser.add_argument('--quick',action='store_true',help='run only the smallest size of each sweep')
+    parser.add_argument('--only',nargs='*',help='names of the benchmarks to run')
+    parser.add_argument('--device',default='qasm_simulator',help="device used when running jobs, such as 'exact'")
+    parser.add_argument('--shots',type=int,default=1024,help='shots used when the sweep is not over shots')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--no-memory',action='store_true',help='skip tracemalloc, which slows down the timings')
+    parser.add_argument('--json',help='file to save the results to')
+    parser.add_argument('--compare',help='file of saved results, to which times are compared')
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    old = {}
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)['results']
+
+    # anything written by the package (such as images) goes in a temporary directory
+    cwd = os.getcwd()
+    work = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work,'outputs'))
+    os.chdir(work)
+    if not args.no_memory:
+        tracemalloc.start()
+
+    results = {}
+    try:
+        print('%-24s %-10s %-16s %10s %12s'%('benchmark','size','phase','seconds','peak MiB'))
+        for (benchmark,sizes,quick_sizes) in BENCHMARKS:
+            name = benchmark.__name__
+            if args.only and name not in args.only:
+                continue
+            for size in (quick_sizes if args.quick else sizes):
+                records = run(benchmark,size,args.device,args.shots,args.seed,not args.no_memory)
+                for (phase,seconds,peak) in records:
+                    key = '%s/%s/%s'%(name,size,phase)
+                    results[key] = {'seconds':seconds,'peak_bytes':peak}
+                    line = '%-24s %-10s %-16s %10.4f %12s'%(name,size,phase,seconds,'-' if peak is None else '%.2f'%(peak/2**20))
+                    if key in old:
+                        line += '   x%.2f'%(seconds/old[key]['seconds'])
+                    print(line)
+    finally:
+        os.chdir(cwd)
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    if args.json:
+        from CreativeQiskit.__version__ import __version__
+        # serialized before the file is opened, so that a failure cannot leave it truncated
+        text = json.dumps({'version':__version__,'device':args.device,'shots':args.shots,'seed':args.seed,'results':results},indent=1)
+        with open(args.json,'w') as file:
+            file.write(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# coding: utf-8
+
+# Checks that the noise applied with device='exact' matches that of jobs run on the Aer simulator with the same noise model.
+
+import numpy as np
+import pytest
+
+pytest.importorskip('qiskit') # needed to import CreativeQiskit at all
+
+import CreativeQiskit
+from CreativeQiskit.CreativeQiskit import _execute, _exact_prob, _prob_of_one, _twobit_prepare_gates, _twobit_measure_gates
+
+shots = 20000
+tolerance = 4*np.sqrt(0.25/shots) # four standard deviations for the worst case of p=0.5
+
+
+def aer_prob(qc,noisy=True):
+    # the fraction of shots that give 1, when the single qubit circuit is run on the Aer simulator with noise
+    result = _execute(qc,CreativeQiskit.get_backend('qasm_simulator'),CreativeQiskit.get_noise(noisy),shots,cache=False)
+    return _prob_of_one(result.get_counts(),shots)
+
+
+@pytest.mark.parametrize('adds',[1,3,7])
+def test_ladder(adds):
+    CreativeQiskit.set_seed(adds)
+    l = CreativeQiskit.ladder(5)
+    for _ in range(adds):
+        l.add(1)
+    exact = _exact_prob(np.sin(l.angle/2)**2,True,l.gates)
+    assert abs(aer_prob(l._circuit())-exact) < tolerance
+
+@pytest.mark.parametrize('prepared',['X','Y','Z'])
+@pytest.mark.parametrize('b',[False,True])
+@pytest.mark.parametrize('measured',['X','Y','Z'])
+def test_twobit(prepared,b,measured):
+    CreativeQiskit.set_seed(0)
+    bit = CreativeQiskit.twobit()
+    bit.prepare({prepared:b})
+    axis = 'XYZ'.index(measured)
+    gates = _twobit_prepare_gates['XYZ'.index(prepared),int(b)] + _twobit_measure_gates[axis]
+    exact = _exact_prob((1-bit.bloch[axis])/2,True,gates)
+    assert abs(aer_prob(bit._circuit(measured))-exact) < tolerance
+
+@pytest.mark.parametrize('gates',[
+    [('h',0),('cx',0,1)],
+    [('x',0),('s',1),('h',1),('cz',0,1),('sdg',0)],
+    [('ry',0.7,0),('h',1),('crz',1.1,0,1),('swap',1,0),('t',1)],
+])
+def test_pauli_grid(gates):
+    # the expectation values of exact mode, and those sampled from the noisy qasm simulator, for the same circuit
+    CreativeQiskit.set_seed(0)
+    rhos = []
+    for device in ['exact','qasm_simulator']:
+        grid = CreativeQiskit.pauli_grid(device=device,noisy=True,shots=shots,y_boxes=True)
+        for gate in gates:
+            args = [ arg if type(arg) is float else grid.qr[arg] for arg in gate[1:] ]
+            getattr(grid.qc,gate[0])(*args)
+        grid.get_rho()
+        rhos.append(grid.rho)
+    for pauli in rhos[0]:
+        # expectation values have twice the standard deviation of probabilities
+        assert abs(rhos[0][pauli]-rhos[1][pauli]) < 2*tolerance, pauli
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+# Checks the matrix product state used by `random_grid` against a dense statevector simulation.
+
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip('qiskit') # needed to import CreativeQiskit at all
+
+from CreativeQiskit.CreativeQiskit import _mps, _gate_matrix
+
+
+def random_unitary(n,rng):
+    # a random unitary on n qubits, from the QR decomposition of a complex Gaussian matrix
+    Q,R = np.linalg.qr( rng.normal(size=(2**n,2**n)) + 1j*rng.normal(size=(2**n,2**n)) )
+    return Q * (np.diag(R)/np.abs(np.diag(R)))
+
+def dense(state):
+    # contracts the tensors of an `_mps` into a statevector of shape (2,)*num, with axis j for qubit j
+    psi = state.tensors[0]
+    for tensor in state.tensors[1:]:
+        psi = np.tensordot(psi,tensor,axes=1)
+    return psi.reshape([2]*state.num)
+
+def apply_dense(psi,gate,qubits):
+    # applies a gate to the given qubits of a dense statevector, with the first of `qubits` as its first qubit
+    n = len(qubits)
+    psi = np.tensordot(gate.reshape([2]*2*n),psi,axes=(list(range(n,2*n)),qubits))
+    return np.moveaxis(psi,list(range(n)),qubits)
+
+
+@pytest.mark.parametrize('j,k',[ (j,k) for (j,k) in itertools.permutations(range(5),2) ])
+def test_apply_pair(j,k):
+    # every ordered pair of qubits, including j>k and non-neighbours, on a state that is already entangled
+    rng = np.random.RandomState(5*j+k)
+    state = _mps(5)
+    psi = np.zeros([2]*5,dtype=complex)
+    psi[(0,)*5] = 1
+    for (a,b) in [(0,1),(2,3),(3,4),(1,2)]:
+        gate = random_unitary(2,rng)
+        state.apply_pair(gate,a,b)
+        psi = apply_dense(psi,gate,[a,b])
+    gate = random_unitary(2,rng)
+    state.apply_pair(gate,j,k)
+    psi = apply_dense(psi,gate,[j,k])
+    assert np.allclose(dense(state),psi)
+
+def test_random_circuit():
+    # a circuit of the gates used by `random_grid`, on an untruncated state
+    rng = np.random.RandomState(0)
+    num = 6
+    state = _mps(num)
+    psi = np.zeros([2]*num,dtype=complex)
+    psi[(0,)*num] = 1
+    for _ in range(40):
+        if rng.random_sample()<0.5:
+            name = rng.choice(['h','s','sdg','x','rx','ry'])
+            gate = _gate_matrix(name,np.pi*rng.random_sample())
+            j = rng.randint(num)
+            state.apply(gate,j)
+            psi = apply_dense(psi,gate,[j])
+        else:
+            name = rng.choice(['crz','swap','cx'])
+            gate = _gate_matrix(name,np.pi*rng.random_sample())
+            j,k = rng.choice(num,2,replace=False)
+            state.apply_pair(gate,j,k)
+            psi = apply_dense(psi,gate,[j,k])
+    assert np.allclose(dense(state),psi)
+
+def test_sample():
+    # the sampled bits follow the probabilities of the dense state
+    rng = np.random.RandomState(1)
+    state = _mps(3)
+    psi = np.zeros([2]*3,dtype=complex)
+    psi[0,0,0] = 1
+    for (j,k) in [(0,2),(2,1),(1,0)]:
+        gate = random_unitary(2,rng)
+        state.apply_pair(gate,j,k)
+        psi = apply_dense(psi,gate,[j,k])
+    np.random.seed(2)
+    shots = 20000
+    bits = state.sample(shots)
+    freqs = np.bincount( bits[:,0]*4 + bits[:,1]*2 + bits[:,2], minlength=8 ) / shots
+    assert np.allclose(freqs,np.abs(psi.reshape(-1))**2,atol=0.02)